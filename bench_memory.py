@@ -0,0 +1,74 @@
+import argparse
+import gc
+import json
+import os
+import tempfile
+import tracemalloc
+from config import Config
+
+# Bytes per subscriber held in memory by the user store, for the historical
+# dict-of-dicts layout (what json.load returns) and for DataManager records.
+
+
+def _synthetic_users(users: int, groups: int):
+    data = {}
+    for i in range(users):
+        g = i % groups
+        group = f"loe:{g // 2 + 1}.{g % 2 + 1}"
+        data[str(100000000 + i)] = {
+            "group": group,
+            "last_schedule": [["08:00", "10:00"], [f"{12 + g % 6:02d}:00", f"{14 + g % 6:02d}:00"]],
+            "pending_schedule": None,
+            "pending_count": 0,
+        }
+    return data
+
+
+def _measure(load):
+    gc.collect()
+    tracemalloc.start()
+    obj = load()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+
+def run(users: int, groups: int):
+    from data_manager import DataManager
+
+    workdir = tempfile.mkdtemp(prefix="power-outage-bench-")
+    path = os.path.join(workdir, "user_data.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(_synthetic_users(users, groups), f, ensure_ascii=False, indent=2)
+
+    def load_dicts():
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    Config.DATA_FILE = path
+    legacy, legacy_bytes = _measure(load_dicts)
+    del legacy
+    manager, compact_bytes = _measure(DataManager)
+    assert len(manager.get_all_users()) == users
+    del manager
+    os.remove(path)
+    os.rmdir(workdir)
+
+    return legacy_bytes / users, compact_bytes / users
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description="Пам'ять на одного користувача: dict-of-dicts vs DataManager.")
+    arg_parser.add_argument("--users", type=int, default=100000)
+    arg_parser.add_argument("--groups", type=int, default=12)
+    args = arg_parser.parse_args(argv)
+
+    before, after = run(args.users, args.groups)
+    print(f"👥 {args.users} користувачів, {args.groups} груп")
+    print(f"До (dict з dict): {before:.0f} байт/користувач")
+    print(f"Після (DataManager): {after:.0f} байт/користувач ({before / after:.1f}× менше)")
+
+
+if __name__ == '__main__':
+    main()
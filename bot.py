@@ -1,9 +1,12 @@
 import logging
 from typing import List
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
 from config import Config
-from data_manager import DataManager
+from data_manager import DataManager, DeliveryPrefs
+from loop_watchdog import LoopWatchdog
+from outbox import FloodWait, Undeliverable
 from parser import PowerOnParser
 from scheduler import ScheduleMonitor
 
@@ -18,23 +21,61 @@ class PowerOutageBot:
         self.data_manager = DataManager()
         self.parser = PowerOnParser()
         self.schedule_monitor = ScheduleMonitor(self.data_manager, self.parser)
+        self.schedule_monitor.bot = self
         
-        self.application = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).build()
+        self.watchdog = LoopWatchdog() if Config.WATCHDOG_ENABLED else None
+        
+        # The outbox sends a whole batch concurrently; PTB's default pool holds a single connection.
+        builder = Application.builder().token(Config.TELEGRAM_BOT_TOKEN).connection_pool_size(
+            Config.OUTBOX_BATCH_SIZE + 8
+        )
+        if Config.TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(Config.TELEGRAM_API_BASE_URL)
+        if self.watchdog:
+            builder = builder.post_init(self._post_init).post_shutdown(self._post_shutdown)
+        self.application = builder.build()
         if self.application.job_queue:
             self.application.job_queue.run_repeating(
-                self._scheduled_check,
+                self._tracked("job:scheduled_check", self._scheduled_check),
                 interval=Config.CHECK_INTERVAL_MINUTES * 60,
                 first=5,
+                # A run delayed by a busy loop still happens (once) instead of being dropped.
+                # Overlapping runs reach ScheduleMonitor, which skips and counts them.
+                job_kwargs={"coalesce": True, "misfire_grace_time": None, "max_instances": 2},
+            )
+            # Also resumes deliveries left in the outbox by a previous process.
+            self.application.job_queue.run_repeating(
+                self._tracked("job:drain_outbox", self._drain_outbox),
+                interval=Config.OUTBOX_RETRY_INTERVAL,
+                first=1,
             )
         
         self._setup_handlers()
     
+    def _tracked(self, name: str, callback):
+        return self.watchdog.track(name, callback) if self.watchdog else callback
+    
+    async def _post_init(self, application: Application):
+        self.watchdog.start()
+    
+    async def _post_shutdown(self, application: Application):
+        await self.watchdog.stop()
+    
     def _setup_handlers(self):
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("group", self.group_command))
-        self.application.add_handler(CommandHandler("status", self.status_command))
-        self.application.add_handler(CommandHandler("check", self.check_command))
-        self.application.add_handler(CallbackQueryHandler(self.button_callback))
+        handlers = [
+            ("start", self.start_command),
+            ("group", self.group_command),
+            ("status", self.status_command),
+            ("check", self.check_command),
+            ("notify", self.notify_command),
+            ("profile", self.profile_command),
+            ("watchdog", self.watchdog_command),
+            ("outbox", self.outbox_command),
+            ("cycle", self.cycle_command),
+        ]
+        for command, callback in handlers:
+            self.application.add_handler(CommandHandler(command, self._tracked(f"/{command}", callback)))
+        self.application.add_handler(CallbackQueryHandler(self._tracked("button", self.button_callback)))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_chat.id
@@ -65,10 +106,10 @@ class PowerOutageBot:
             )
             return
         
-        current_schedule = self.parser.get_group_schedule(user_group)
+        current_schedule = await self.schedule_monitor.get_group_schedule(user_group)
         saved_schedule = self.data_manager.get_user_schedule(user_id)
         
-        message = f"📊 *Статус групи {user_group}*\n\n"
+        message = f"📊 *Статус групи {self.parser.group_label(user_group)}*\n\n"
         
         if current_schedule:
             message += "🔄 *Поточний графік:*\n"
@@ -114,7 +155,7 @@ class PowerOutageBot:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await update.message.reply_text(
-                f"⚠️ *Знайдено зміни в графіку групи {user_group}:*\n\n{changes}",
+                f"⚠️ *Знайдено зміни в графіку групи {self.parser.group_label(user_group)}:*\n\n{changes}",
                 parse_mode='Markdown',
                 reply_markup=reply_markup
             )
@@ -127,10 +168,115 @@ class PowerOutageBot:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await update.message.reply_text(
-                f"✅ Графік групи {user_group} не змінився.",
+                f"✅ Графік групи {self.parser.group_label(user_group)} не змінився.",
                 reply_markup=reply_markup
             )
     
+    async def notify_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_chat.id
+        args = context.args or []
+        prefs = self.data_manager.get_delivery_prefs(user_id)
+        
+        if args and args[0] == "quiet":
+            if args[1:2] == ["off"]:
+                prefs = prefs._replace(quiet_start=None, quiet_end=None)
+            else:
+                try:
+                    start, end = (int(hour) % 24 for hour in args[1:3])
+                except ValueError:
+                    await update.message.reply_text("Використання: /notify quiet <з години> <до години> або /notify quiet off")
+                    return
+                prefs = prefs._replace(quiet_start=start, quiet_end=end)
+            self.schedule_monitor.set_delivery_prefs(user_id, prefs)
+        
+        await update.message.reply_text(
+            self._format_delivery_prefs(prefs),
+            parse_mode='Markdown',
+            reply_markup=self._notify_keyboard(prefs)
+        )
+    
+    def _format_delivery_prefs(self, prefs: DeliveryPrefs) -> str:
+        message = "🔔 *Сповіщення:* "
+        if prefs.mode == 'digest':
+            message += f"дайджест раз на {prefs.digest_minutes} хв\n"
+        else:
+            message += "одразу\n"
+        
+        if prefs.quiet_start is not None and prefs.quiet_end is not None:
+            message += f"🌙 *Тихі години:* {prefs.quiet_start:02d}:00 - {prefs.quiet_end:02d}:00\n"
+        else:
+            message += "🌙 *Тихі години:* вимкнено\n"
+        
+        message += "\nЗміни, що накопичились, надходять одним повідомленням з різницею від останнього надісланого графіка."
+        return message
+    
+    def _notify_keyboard(self, prefs: DeliveryPrefs) -> InlineKeyboardMarkup:
+        keyboard = [[InlineKeyboardButton("🔔 Одразу", callback_data="notify_immediate")]]
+        keyboard.append([
+            InlineKeyboardButton(f"🗂 Дайджест {minutes} хв", callback_data=f"notify_digest_{minutes}")
+            for minutes in Config.DIGEST_INTERVALS
+        ])
+        if prefs.quiet_start is not None:
+            keyboard.append([InlineKeyboardButton("🌙 Вимкнути тихі години", callback_data="notify_quiet_off")])
+        else:
+            start, end = Config.QUIET_HOURS_DEFAULT
+            keyboard.append([InlineKeyboardButton(
+                f"🌙 Тихі години {start:02d}:00 - {end:02d}:00", callback_data="notify_quiet_on"
+            )])
+        return InlineKeyboardMarkup(keyboard)
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_chat.id
+        if user_id not in Config.ADMIN_CHAT_IDS:
+            return
+        
+        profiler = self.schedule_monitor.profiler
+        args = context.args or []
+        
+        if args and args[0] == "stop":
+            report = profiler.stop()
+            await update.message.reply_text(report or "ℹ️ Профілювання не було активне або ще немає даних.")
+            return
+        
+        try:
+            cycles = int(args[0]) if args else 1
+        except ValueError:
+            await update.message.reply_text("Використання: /profile [кількість перевірок] [save] або /profile stop")
+            return
+        
+        save = "save" in args[1:]
+        profiler.arm(cycles, user_id, save)
+        await update.message.reply_text(
+            f"🧪 Профілювання увімкнено на {max(1, cycles)} наступних перевірок."
+            + (" Сирий профіль буде збережено на диск." if save else "")
+        )
+    
+    async def watchdog_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_chat.id not in Config.ADMIN_CHAT_IDS:
+            return
+        
+        if not self.watchdog:
+            await update.message.reply_text("ℹ️ Watchdog вимкнено (WATCHDOG_ENABLED=false).")
+            return
+        
+        await update.message.reply_text(self.watchdog.format_summary())
+    
+    async def outbox_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_chat.id not in Config.ADMIN_CHAT_IDS:
+            return
+        
+        outbox = self.schedule_monitor.outbox
+        await update.message.reply_text(
+            f"📬 Черга сповіщень: {outbox.depth}, найстаріше {outbox.oldest_age():.0f} с\n"
+            f"Доставлено: {outbox.delivered_total}, відкинуто: {outbox.dropped_total}"
+        )
+    
+    async def cycle_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_chat.id not in Config.ADMIN_CHAT_IDS:
+            return
+        
+        await update.message.reply_text(self.schedule_monitor.format_cycle_stats())
+    
     async def _send_group_selection(self, user_id: int, context_or_query):
         available_groups = self.parser.get_available_groups()
         
@@ -149,7 +295,7 @@ class PowerOutageBot:
         for i in range(0, len(available_groups), 4):
             row = []
             for group in available_groups[i:i+4]:
-                row.append(InlineKeyboardButton(f"Група {group}", callback_data=f"group_{group}"))
+                row.append(InlineKeyboardButton(f"Група {self.parser.group_label(group)}", callback_data=f"group_{group}"))
             keyboard.append(row)
         
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -174,11 +320,13 @@ class PowerOutageBot:
         callback_data = query.data
         
         if callback_data.startswith("group_"):
-            group = callback_data.replace("group_", "")
+            # Buttons sent before providers were added carry bare group names.
+            group = self.parser.qualify_group(callback_data.replace("group_", "", 1))
             
             available_groups = self.parser.get_available_groups()
             if group in available_groups:
                 self.data_manager.set_user_group(user_id, group)
+                self.schedule_monitor.invalidate(user_id)
                 
                 current_schedule = self.parser.get_group_schedule(group)
                 if current_schedule:
@@ -193,7 +341,7 @@ class PowerOutageBot:
                     reply_markup = InlineKeyboardMarkup(keyboard)
                     
                     await query.edit_message_text(
-                        f"✅ *Групу {group} збережено!*\n\n"
+                        f"✅ *Групу {self.parser.group_label(group)} збережено!*\n\n"
                         f"📊 *Поточний графік:*\n{schedule_text}\n\n"
                         f"🔔 Я буду повідомляти вас про зміни в графіку кожні {Config.CHECK_INTERVAL_MINUTES} хвилин.",
                         parse_mode='Markdown',
@@ -208,7 +356,7 @@ class PowerOutageBot:
                     reply_markup = InlineKeyboardMarkup(keyboard)
                     
                     await query.edit_message_text(
-                        f"✅ *Групу {group} збережено!*\n\n"
+                        f"✅ *Групу {self.parser.group_label(group)} збережено!*\n\n"
                         f"⚠️ Наразі графік для цієї групи відсутній на сайті.\n"
                         f"🔔 Я буду повідомляти вас про зміни в графіку кожні {Config.CHECK_INTERVAL_MINUTES} хвилин.",
                         parse_mode='Markdown',
@@ -217,6 +365,8 @@ class PowerOutageBot:
             else:
                 await query.edit_message_text("❌ Невідома група. Спробуйте ще раз.")
         
+        elif callback_data.startswith("notify_"):
+            await self._handle_notify_callback(query, user_id, callback_data.replace("notify_", "", 1))
         elif callback_data == "cmd_status":
             await self._handle_status_command(query, user_id)
         elif callback_data == "cmd_check":
@@ -238,10 +388,10 @@ class PowerOutageBot:
             )
             return
         
-        current_schedule = self.parser.get_group_schedule(user_group)
+        current_schedule = await self.schedule_monitor.get_group_schedule(user_group)
         saved_schedule = self.data_manager.get_user_schedule(user_id)
         
-        message = f"📊 *Статус групи {user_group}*\n\n"
+        message = f"📊 *Статус групи {self.parser.group_label(user_group)}*\n\n"
         
         if current_schedule:
             message += "🔄 *Поточний графік:*\n"
@@ -291,7 +441,7 @@ class PowerOutageBot:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.edit_message_text(
-                f"⚠️ *Знайдено зміни в графіку групи {user_group}:*\n\n{changes}",
+                f"⚠️ *Знайдено зміни в графіку групи {self.parser.group_label(user_group)}:*\n\n{changes}",
                 parse_mode='Markdown',
                 reply_markup=reply_markup
             )
@@ -304,10 +454,36 @@ class PowerOutageBot:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             await query.edit_message_text(
-                f"✅ Графік групи {user_group} не змінився.",
+                f"✅ Графік групи {self.parser.group_label(user_group)} не змінився.",
                 reply_markup=reply_markup
             )
     
+    async def _handle_notify_callback(self, query, user_id: int, action: str):
+        prefs = self.data_manager.get_delivery_prefs(user_id)
+        
+        if action == "immediate":
+            prefs = prefs._replace(mode='immediate', digest_minutes=0)
+        elif action.startswith("digest_"):
+            try:
+                minutes = int(action.replace("digest_", "", 1))
+            except ValueError:
+                return
+            prefs = prefs._replace(mode='digest', digest_minutes=minutes)
+        elif action == "quiet_on":
+            start, end = Config.QUIET_HOURS_DEFAULT
+            prefs = prefs._replace(quiet_start=start, quiet_end=end)
+        elif action == "quiet_off":
+            prefs = prefs._replace(quiet_start=None, quiet_end=None)
+        else:
+            return
+        
+        self.schedule_monitor.set_delivery_prefs(user_id, prefs)
+        await query.edit_message_text(
+            self._format_delivery_prefs(prefs),
+            parse_mode='Markdown',
+            reply_markup=self._notify_keyboard(prefs)
+        )
+    
     async def _handle_group_command(self, query, user_id: int):
         await self._send_group_selection(user_id, query)
     
@@ -321,32 +497,43 @@ class PowerOutageBot:
         
         return "\n".join(formatted)
     
-    async def send_notification(self, user_id: int, message: str):
+    async def send_notification(self, user_id: int, message: str) -> bool:
         try:
             await self.application.bot.send_message(
                 chat_id=user_id,
                 text=message,
                 parse_mode='Markdown'
             )
+            return True
+        except RetryAfter as e:
+            raise FloodWait(e.retry_after) from e
+        except (Forbidden, BadRequest) as e:
+            raise Undeliverable(str(e)) from e
         except Exception as e:
-            pass
-
-    async def _scheduled_check(self, context: ContextTypes.DEFAULT_TYPE):
-        users = self.data_manager.get_all_users()
+            return False
 
-        for chat_id_str, user_data in users.items():
-            try:
-                chat_id = int(chat_id_str)
-                user_group = user_data.get('group')
-                if not user_group:
-                    continue
+    async def deliver_profile_report(self):
+        report = self.schedule_monitor.profiler.pop_report()
+        if not report:
+            return
+        
+        chat_id, text = report
+        try:
+            # Plain text: function names contain underscores that break Markdown.
+            await self.application.bot.send_message(chat_id=chat_id, text=text[:4096])
+        except Exception as e:
+            logger.warning("Failed to deliver profile report: %s", e)
 
-                changes = await self.schedule_monitor.check_user_schedule(chat_id, user_group)
-                if changes:
-                    message = f"⚠️ *Зміни в графіку групи {user_group}:*\n\n{changes}"
-                    await self.send_notification(chat_id, message)
-            except Exception:
-                pass
+    async def _scheduled_check(self, context: ContextTypes.DEFAULT_TYPE):
+        # The job's next run time has already been advanced past this run when the callback starts.
+        scheduled_at = None
+        if context.job and context.job.next_t:
+            scheduled_at = context.job.next_t.timestamp() - Config.CHECK_INTERVAL_MINUTES * 60
+        await self.schedule_monitor.check_all_users(scheduled_at)
+    
+    async def _drain_outbox(self, context: ContextTypes.DEFAULT_TYPE):
+        # Bounded so a paced drain of a large backlog ends before the next run is due.
+        await self.schedule_monitor.deliver_outbox(Config.OUTBOX_RETRY_INTERVAL)
     
     def run(self):
         self.application.run_polling(drop_pending_updates=True)
@@ -5,6 +5,8 @@ load_dotenv()
 
 class Config:
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
+    # Інший Bot API сервер (локальний telegram-bot-api або заглушка), напр. http://127.0.0.1:8081/bot
+    TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', '')
     
     POWERON_URL = "https://poweron.loe.lviv.ua/"
     LOE_API_BASE_URL = "https://api.loe.lviv.ua"
@@ -13,15 +15,61 @@ class Config:
     LOE_API_GROUPS_MENU_TYPE = "power-group"
     
     CHECK_INTERVAL_MINUTES = 10
+    # Перевірка, що не встигла за дедлайн, продовжує з наступного чату в наступному циклі
+    CYCLE_DEADLINE_SECONDS = int(os.getenv('CYCLE_DEADLINE_SECONDS', str(CHECK_INTERVAL_MINUTES * 60 - 60)))
+    # Дедлайн перевіряється між порціями чатів; перша порція обробляється завжди
+    CYCLE_SLICE_SIZE = 500
+    
+    # Повторні /check і /status протягом цього часу відповідають з останнього результату
+    INTERACTIVE_COOLDOWN_SECONDS = 30
     
     REQUEST_TIMEOUT = 30
     MAX_RETRIES = 3
     RETRY_DELAY = 5
     
+    # Джерела графіків (id через кому, див. providers.PROVIDERS); опитуються паралельно
+    SCHEDULE_PROVIDERS = [
+        provider.strip() for provider in os.getenv('SCHEDULE_PROVIDERS', 'loe').split(',') if provider.strip()
+    ]
+    PROVIDER_POLL_TIMEOUT = 90
+    PROVIDER_FETCH_WORKERS = 4
+    HTTP_POOL_SIZE = 10
+    
     USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     
     DATA_FILE = "user_data.json"
     
+    # Черга підтверджених сповіщень, що переживає перезапуск
+    OUTBOX_FILE = "outbox.jsonl"
+    OUTBOX_BATCH_SIZE = 25
+    OUTBOX_MAX_ATTEMPTS = 5
+    OUTBOX_RETRY_INTERVAL = 30
+    OUTBOX_DEDUP_CHATS = 100000
+    # Ліміт Telegram ~30 повідомлень/с на бота; 0 — без обмеження
+    OUTBOX_RATE_PER_SECOND = 25
+    # Сповіщення, що не вдалося доставити через тимчасові помилки за добу, відкидаються
+    OUTBOX_MAX_AGE = 24 * 3600
+    
+    # Режими доставки (/notify): дайджест раз на N хвилин і тихі години за місцевим часом
+    TIMEZONE = os.getenv('TIMEZONE', 'Europe/Kyiv')
+    DIGEST_INTERVALS = [30, 60]
+    QUIET_HOURS_DEFAULT = (23, 7)
+    
+    # Адміністратори (chat_id через кому), яким доступна команда /profile
+    ADMIN_CHAT_IDS = {
+        int(chat_id) for chat_id in os.getenv('ADMIN_CHAT_IDS', '').split(',')
+        if chat_id.strip().lstrip('-').isdigit()
+    }
+    PROFILE_TOP_N = 15
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    
+    # Watchdog циклу подій: затримка циклу, час обробників/задач, стек при зависанні
+    WATCHDOG_ENABLED = os.getenv('WATCHDOG_ENABLED', 'false').lower() == 'true'
+    WATCHDOG_INTERVAL = 0.1
+    WATCHDOG_LAG_THRESHOLD = float(os.getenv('WATCHDOG_LAG_THRESHOLD', '0.25'))
+    WATCHDOG_EXPORT_FILE = os.getenv('WATCHDOG_EXPORT_FILE', '')
+    WATCHDOG_EXPORT_INTERVAL = 60
+    
     # Використовувати тестові дані для розробки
     USE_TEST_DATA = os.getenv('USE_TEST_DATA', 'false').lower() == 'true'
     
@@ -1,77 +1,333 @@
 import json
+import logging
 import os
-from typing import Dict, List, Optional, Tuple
+import sys
+from collections import namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+Schedule = Tuple[Tuple[str, str], ...]
+
+# Per-chat delivery preferences. mode is 'immediate' or 'digest'; quiet hours are local
+# hours [quiet_start, quiet_end) and may wrap past midnight. Instances are shared between chats.
+DeliveryPrefs = namedtuple('DeliveryPrefs', ['mode', 'digest_minutes', 'quiet_start', 'quiet_end'])
+DEFAULT_DELIVERY = DeliveryPrefs('immediate', 0, None, None)
+
+
+class UserRecord:
+    # One subscriber. Schedules are shared immutable tuples, so users of the same group
+    # point at the same object instead of holding their own nested lists.
+    __slots__ = ('group', 'last_schedule', 'pending_schedule', 'pending_count',
+                 'delivery', 'seen_schedule', 'digest_due')
+
+    def __init__(self, group: Optional[str] = None, last_schedule: Schedule = (),
+                 pending_schedule: Optional[Schedule] = None, pending_count: int = 0,
+                 delivery: Optional[DeliveryPrefs] = None, seen_schedule: Optional[Schedule] = None,
+                 digest_due: Optional[float] = None):
+        self.group = group
+        self.last_schedule = last_schedule
+        self.pending_schedule = pending_schedule
+        self.pending_count = pending_count
+        # None means DEFAULT_DELIVERY
+        self.delivery = delivery
+        # While a notification is deferred: the schedule the user last saw, and when to send it
+        self.seen_schedule = seen_schedule
+        self.digest_due = digest_due
+
+    def get(self, key: str, default=None):
+        # dict-style access kept for callers of get_all_users()
+        if key not in self.__slots__:
+            return default
+        value = getattr(self, key)
+        return default if value is None else value
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict:
+        data = {
+            'group': self.group,
+            'last_schedule': _schedule_to_lists(self.last_schedule),
+            'pending_schedule': None if self.pending_schedule is None else _schedule_to_lists(self.pending_schedule),
+            'pending_count': self.pending_count,
+        }
+        if self.delivery is not None:
+            data['delivery'] = self.delivery._asdict()
+        if self.seen_schedule is not None:
+            data['seen_schedule'] = _schedule_to_lists(self.seen_schedule)
+            data['digest_due'] = self.digest_due
+        return data
+
+
+class _UsersView(Mapping):
+    # Read-only view with the historical str chat_id keys over the int-keyed store.
+    __slots__ = ('_records',)
+
+    def __init__(self, records: Dict[int, UserRecord]):
+        self._records = records
+
+    def __getitem__(self, chat_id) -> UserRecord:
+        return self._records[int(chat_id)]
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(chat_id) for chat_id in self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+
+def _schedule_to_lists(schedule: Schedule) -> List[List[str]]:
+    return [list(interval) for interval in schedule]
+
+
 class DataManager:
+    _MIN_POOL_LIMIT = 1024
+
     def __init__(self):
         self.data_file = Config.DATA_FILE
-        self._data = self._load_data()
-    
-    def _load_data(self) -> Dict:
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
-                return {}
-        return {}
-    
+        # Canonical schedule tuples; pruned when it outgrows the set still referenced by users.
+        self._schedules: Dict[Schedule, Schedule] = {}
+        self._pool_limit = self._MIN_POOL_LIMIT
+        self._batch_depth = 0
+        self._dirty = False
+        self._delivery_prefs: Dict[DeliveryPrefs, DeliveryPrefs] = {}
+        self._data: Dict[int, UserRecord] = {}
+        # Entries that could not be parsed, by their original key; written back unchanged.
+        self._unparsed: Dict[str, object] = {}
+        self._loading = False
+        self._load_data()
+        # Chats with a deferred (digest / quiet hours) notification
+        self._deferred = {chat_id for chat_id, record in self._data.items() if record.seen_schedule is not None}
+
+    def _load_data(self):
+        if not os.path.exists(self.data_file):
+            return
+        try:
+            with open(self.data_file, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except (json.JSONDecodeError, IOError) as e:
+            return
+
+        # The schedule pool is pruned against self._data, which is incomplete until the load ends.
+        self._loading = True
+        try:
+            for chat_id, user in raw.items():
+                try:
+                    self._data[int(chat_id)] = self._record_from_dict(user)
+                except (TypeError, ValueError, AttributeError):
+                    self._unparsed[chat_id] = user
+        finally:
+            self._loading = False
+        if len(self._schedules) >= self._pool_limit:
+            self._prune_schedules()
+
+        if self._unparsed:
+            logger.warning(
+                "Kept %d unparseable user records as is: %s",
+                len(self._unparsed), ", ".join(list(self._unparsed)[:10]),
+            )
+
+    def _record_from_dict(self, user: Dict) -> UserRecord:
+        pending = user.get('pending_schedule')
+        delivery = user.get('delivery')
+        seen = user.get('seen_schedule')
+        return UserRecord(
+            group=self._intern_group(user.get('group')),
+            last_schedule=self._intern_schedule(user.get('last_schedule') or []),
+            pending_schedule=None if pending is None else self._intern_schedule(pending),
+            pending_count=int(user.get('pending_count', 0) or 0),
+            delivery=self._delivery_from_dict(delivery),
+            seen_schedule=None if seen is None else self._intern_schedule(seen),
+            digest_due=None if seen is None else self._digest_due_from_dict(user.get('digest_due')),
+        )
+
+    def _delivery_from_dict(self, delivery) -> Optional[DeliveryPrefs]:
+        # Malformed preferences fall back to the default mode instead of dropping the user.
+        try:
+            return self._intern_delivery(DeliveryPrefs(**delivery)) if delivery else None
+        except TypeError:
+            return None
+
+    @staticmethod
+    def _digest_due_from_dict(due) -> float:
+        # A missing or malformed due time makes the deferred change due right away.
+        return float(due) if isinstance(due, (int, float)) and not isinstance(due, bool) else 0.0
+
+    @contextmanager
+    def batch(self):
+        # Writes inside the block are coalesced into a single save when it exits.
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._dirty:
+                self._save_data()
+
     def _save_data(self) -> bool:
+        if self._batch_depth:
+            self._dirty = True
+            return True
+        self._dirty = False
+        tmp_path = f"{self.data_file}.tmp"
         try:
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self._data, f, ensure_ascii=False, indent=2)
+            # Streamed record by record: no second full copy of the user base while saving.
+            # Written aside and swapped in, so a crash mid-write never leaves a torn user_data.json.
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("{")
+                first = True
+                for chat_id, record in self._data.items():
+                    f.write("\n" if first else ",\n")
+                    first = False
+                    f.write(f'  "{chat_id}": {json.dumps(record.to_dict(), ensure_ascii=False)}')
+                for key, value in self._unparsed.items():
+                    f.write("\n" if first else ",\n")
+                    first = False
+                    f.write(f'  {json.dumps(key, ensure_ascii=False)}: {json.dumps(value, ensure_ascii=False)}')
+                f.write("}\n" if first else "\n}\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.data_file)
             return True
         except IOError as e:
             return False
-    
+
+    @staticmethod
+    def _intern_group(group: Optional[str]) -> Optional[str]:
+        return sys.intern(group) if isinstance(group, str) else None
+
+    def _intern_schedule(self, schedule) -> Schedule:
+        key = tuple((sys.intern(str(start)), sys.intern(str(end))) for start, end in schedule)
+        canonical = self._schedules.get(key)
+        if canonical is None:
+            if len(self._schedules) >= self._pool_limit and not self._loading:
+                self._prune_schedules()
+            canonical = self._schedules[key] = key
+        return canonical
+
+    def _intern_delivery(self, prefs: DeliveryPrefs) -> Optional[DeliveryPrefs]:
+        if prefs == DEFAULT_DELIVERY:
+            return None
+        return self._delivery_prefs.setdefault(prefs, prefs)
+
+    def _prune_schedules(self):
+        live = {}
+        for record in self._data.values():
+            live[record.last_schedule] = record.last_schedule
+            if record.pending_schedule is not None:
+                live[record.pending_schedule] = record.pending_schedule
+            if record.seen_schedule is not None:
+                live[record.seen_schedule] = record.seen_schedule
+        self._schedules = live
+        self._pool_limit = max(self._MIN_POOL_LIMIT, 2 * len(live))
+
+    def _record(self, chat_id: int) -> UserRecord:
+        chat_id = int(chat_id)
+        record = self._data.get(chat_id)
+        if record is None:
+            record = self._data[chat_id] = UserRecord()
+            # A fresh record replaces whatever unparseable entry the chat had.
+            self._unparsed.pop(str(chat_id), None)
+        return record
+
     def set_user_group(self, chat_id: int, group: str) -> bool:
-        chat_id_key = str(chat_id)
-        if chat_id_key not in self._data:
-            self._data[chat_id_key] = {}
-        
-        self._data[chat_id_key]['group'] = group
-        self._data[chat_id_key]['last_schedule'] = []
-        self._data[chat_id_key]['pending_schedule'] = None
-        self._data[chat_id_key]['pending_count'] = 0
-        
+        record = self._record(chat_id)
+        record.group = self._intern_group(group)
+        record.last_schedule = ()
+        record.pending_schedule = None
+        record.pending_count = 0
+        # A new group starts from a fresh baseline; nothing deferred carries over.
+        record.seen_schedule = None
+        record.digest_due = None
+        self._deferred.discard(int(chat_id))
+
         return self._save_data()
-    
+
     def get_user_group(self, chat_id: int) -> Optional[str]:
-        return self._data.get(str(chat_id), {}).get('group')
-    
+        record = self._data.get(int(chat_id))
+        return record.group if record else None
+
     def update_user_schedule(self, chat_id: int, schedule: List[List[str]]) -> bool:
-        if str(chat_id) not in self._data:
-            self._data[str(chat_id)] = {}
-        
-        self._data[str(chat_id)]['last_schedule'] = schedule
+        self._record(chat_id).last_schedule = self._intern_schedule(schedule)
         return self._save_data()
-    
+
     def get_user_schedule(self, chat_id: int) -> List[List[str]]:
-        return self._data.get(str(chat_id), {}).get('last_schedule', [])
+        record = self._data.get(int(chat_id))
+        return _schedule_to_lists(record.last_schedule) if record else []
 
     def get_pending_schedule(self, chat_id: int):
-        return self._data.get(str(chat_id), {}).get('pending_schedule')
+        record = self._data.get(int(chat_id))
+        if record is None or record.pending_schedule is None:
+            return None
+        return _schedule_to_lists(record.pending_schedule)
 
     def get_pending_count(self, chat_id: int) -> int:
-        return int(self._data.get(str(chat_id), {}).get('pending_count', 0) or 0)
+        record = self._data.get(int(chat_id))
+        return record.pending_count if record else 0
 
     def set_pending_change(self, chat_id: int, pending_schedule, pending_count: int) -> bool:
-        if str(chat_id) not in self._data:
-            self._data[str(chat_id)] = {}
-
-        self._data[str(chat_id)]['pending_schedule'] = pending_schedule
-        self._data[str(chat_id)]['pending_count'] = pending_count
+        schedule = None if pending_schedule is None else self._intern_schedule(pending_schedule)
+        count = int(pending_count or 0)
+        # Most checks find nothing pending and nothing new; skip rewriting the file for those.
+        existing = self._data.get(int(chat_id))
+        if existing is not None and existing.pending_schedule == schedule and existing.pending_count == count:
+            return True
+        record = self._record(chat_id)
+        record.pending_schedule = schedule
+        record.pending_count = count
         return self._save_data()
 
     def clear_pending_change(self, chat_id: int) -> bool:
         return self.set_pending_change(chat_id, None, 0)
-    
-    def get_all_users(self) -> Dict:
-        return self._data
-    
+
+    def get_delivery_prefs(self, chat_id: int) -> DeliveryPrefs:
+        record = self._data.get(int(chat_id))
+        return (record.delivery if record else None) or DEFAULT_DELIVERY
+
+    def set_delivery_prefs(self, chat_id: int, prefs: DeliveryPrefs) -> bool:
+        self._record(chat_id).delivery = self._intern_delivery(prefs)
+        return self._save_data()
+
+    def defer_change(self, chat_id: int, seen_schedule: List[List[str]], due: float) -> bool:
+        # Keeps the schedule the user saw before the first deferred change and the earliest due time,
+        # so later revisions in the same window merge into one notification.
+        record = self._record(chat_id)
+        if record.seen_schedule is None:
+            record.seen_schedule = self._intern_schedule(seen_schedule)
+            record.digest_due = due
+            self._deferred.add(int(chat_id))
+        return self._save_data()
+
+    def get_deferred(self, chat_id: int) -> Tuple[Optional[List[List[str]]], Optional[float]]:
+        record = self._data.get(int(chat_id))
+        if record is None or record.seen_schedule is None:
+            return None, None
+        return _schedule_to_lists(record.seen_schedule), record.digest_due
+
+    def clear_deferred(self, chat_id: int) -> bool:
+        record = self._data.get(int(chat_id))
+        if record is None or record.seen_schedule is None:
+            return True
+        record.seen_schedule = None
+        record.digest_due = None
+        self._deferred.discard(int(chat_id))
+        return self._save_data()
+
+    def deferred_chats(self) -> List[int]:
+        return list(self._deferred)
+
+    def get_all_users(self) -> Mapping:
+        return _UsersView(self._data)
+
     def remove_user(self, chat_id: int) -> bool:
-        if str(chat_id) in self._data:
-            del self._data[str(chat_id)]
-            return self._save_data()
-        return True
+        removed = self._unparsed.pop(str(chat_id), None) is not None
+        if self._data.pop(int(chat_id), None) is not None:
+            self._deferred.discard(int(chat_id))
+            removed = True
+        return self._save_data() if removed else True
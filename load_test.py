@@ -0,0 +1,373 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlparse
+from config import Config
+
+# Offline load harness: a stub LOE API and a stub Bot API on localhost drive a real
+# PowerOutageBot with synthetic subscribers. Nothing leaves the machine.
+
+BOT_TOKEN = "123456:LOADTEST"
+
+
+class _Backlogged(ThreadingHTTPServer):
+    # The default backlog of 5 makes concurrent clients wait on SYN retransmits (~1 s each).
+    request_queue_size = 256
+
+
+class _StubServer:
+    def __init__(self, handler_cls):
+        self.httpd = _Backlogged(("127.0.0.1", 0), handler_cls)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+        self.lock = threading.Lock()
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status: int = 200):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _LoeHandler(_QuietHandler):
+    def do_GET(self):
+        stub = self.server.stub
+        html = stub.record_request()
+
+        if urlparse(self.path).path.endswith("/menus"):
+            self._send_json({
+                "hydra:member": [
+                    {"menuItems": [{"name": "Today", "rawHtml": html}]}
+                ]
+            })
+            return
+
+        body = html.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeLoeServer(_StubServer):
+    # Serves `/api/menus` (and the HTML fallback page) from a scripted list of schedules.
+    def __init__(self, script: List[Dict[str, List[List[str]]]]):
+        super().__init__(_LoeHandler)
+        self.pages = [build_schedule_html(schedule) for schedule in script]
+        self.step = 0
+        self.requests = 0
+
+    def record_request(self) -> str:
+        with self.lock:
+            self.requests += 1
+            return self.pages[self.step]
+
+
+class _BotApiHandler(_QuietHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length).decode("utf-8") if length else ""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(raw or "{}")
+        else:
+            params = {}
+            for key, value in parse_qsl(raw):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+
+        method = self.path.rsplit("/", 1)[-1]
+        self._send_json({"ok": True, "result": self.server.stub.handle(method, params)})
+
+
+class FakeBotApiServer(_StubServer):
+    # Minimal Bot API: enough for Application.initialize(), replies, edits and callback answers.
+    def __init__(self):
+        super().__init__(_BotApiHandler)
+        self.calls: Dict[str, int] = {}
+        self.deliveries: List[tuple] = []
+        self._message_id = 0
+
+    def handle(self, method: str, params: Dict):
+        now = time.monotonic()
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method == "getMe":
+                return {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_test_bot"}
+            if method == "answerCallbackQuery":
+                return True
+
+            chat_id = int(params.get("chat_id", 0))
+            if method == "sendMessage":
+                self.deliveries.append((chat_id, now))
+            self._message_id += 1
+            return {
+                "message_id": int(params.get("message_id") or self._message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+
+    def deliveries_since(self, since: float) -> Dict[int, float]:
+        last = {}
+        with self.lock:
+            for chat_id, at in self.deliveries:
+                if at >= since:
+                    last[chat_id] = max(at, last.get(chat_id, at))
+        return last
+
+
+def build_schedule_html(schedule: Dict[str, List[List[str]]]) -> str:
+    parts = []
+    for group, intervals in schedule.items():
+        times = ", ".join(f"з {start} до {end}" for start, end in intervals)
+        parts.append(f"<p>Група {group}. Електроенергії немає {times}.</p>")
+    return "<div>" + "".join(parts) + "</div>"
+
+
+def default_script(groups: List[str], changed_groups: int) -> List[Dict[str, List[List[str]]]]:
+    base = {group: [["08:00", "10:00"], ["16:00", "18:00"]] for group in groups}
+    changed = dict(base)
+    for group in groups[:changed_groups]:
+        changed[group] = [["09:00", "12:00"], ["16:00", "18:00"]]
+    return [base, changed]
+
+
+def write_subscribers(path: str, users: int, groups: List[str]) -> Dict[int, str]:
+    subscribers = {}
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for i in range(users):
+            chat_id = 100000 + i
+            group = f"loe:{groups[i % len(groups)]}"
+            subscribers[chat_id] = group
+            record = {"group": group, "last_schedule": [], "pending_schedule": None, "pending_count": 0}
+            f.write(("," if i else "") + f'\n  "{chat_id}": {json.dumps(record)}')
+        f.write("\n}\n")
+    return subscribers
+
+
+def _command_update(update_id: int, chat_id: int, command: str) -> Dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        },
+    }
+
+
+def _callback_update(update_id: int, chat_id: int, data: str) -> Dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "…",
+            },
+        },
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # Nearest-rank percentile.
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_load_test(
+    users: int = 1000,
+    groups: Optional[List[str]] = None,
+    changed_groups: int = 2,
+    bursts: int = 5,
+    burst_size: int = 50,
+    max_cycles: int = 5,
+    seed: int = 0,
+) -> Dict:
+    from telegram import Update
+    from bot import PowerOutageBot
+
+    groups = groups or list(Config.FALLBACK_GROUPS)
+    rng = random.Random(seed)
+    workdir = tempfile.mkdtemp(prefix="power-outage-load-")
+    loe = FakeLoeServer(default_script(groups, changed_groups)).start()
+    api = FakeBotApiServer().start()
+
+    Config.DATA_FILE = os.path.join(workdir, "user_data.json")
+    Config.OUTBOX_FILE = os.path.join(workdir, "outbox.jsonl")
+    Config.OUTBOX_RATE_PER_SECOND = 0
+    Config.LOE_API_BASE_URL = loe.url
+    Config.POWERON_URL = f"{loe.url}/"
+    Config.TELEGRAM_BOT_TOKEN = BOT_TOKEN
+    Config.TELEGRAM_API_BASE_URL = f"{api.url}/bot"
+    Config.USE_TEST_DATA = False
+
+    subscribers = write_subscribers(Config.DATA_FILE, users, groups)
+    bot = PowerOutageBot()
+    await bot.application.initialize()
+
+    cycle_times: List[float] = []
+    upstream_per_cycle: List[int] = []
+
+    async def run_cycle():
+        requests_before = loe.requests
+        started = time.monotonic()
+        await bot.schedule_monitor.check_all_users()
+        cycle_times.append(time.monotonic() - started)
+        upstream_per_cycle.append(loe.requests - requests_before)
+
+    async def run_until_delivered(chats, since: float) -> Optional[float]:
+        for _ in range(max_cycles):
+            await run_cycle()
+            delivered = api.deliveries_since(since)
+            if all(chat_id in delivered for chat_id in chats):
+                return max(delivered[chat_id] for chat_id in chats) - since
+        return None
+
+    try:
+        # Warm-up: every subscriber starts with an empty saved schedule and gets the first one.
+        warmup = await run_until_delivered(list(subscribers), time.monotonic())
+
+        loe.step = 1
+        changed = {f"loe:{group}" for group in groups[:changed_groups]}
+        affected = [chat_id for chat_id, group in subscribers.items() if group in changed]
+        propagation = await run_until_delivered(affected, time.monotonic())
+
+        latencies: List[float] = []
+        update_id = 0
+
+        async def timed(payload: Dict):
+            started = time.monotonic()
+            await bot.application.process_update(Update.de_json(payload, bot.application.bot))
+            latencies.append(time.monotonic() - started)
+
+        requests_before_bursts = loe.requests
+        for _ in range(bursts):
+            payloads = []
+            for _ in range(burst_size):
+                update_id += 1
+                chat_id = rng.choice(list(subscribers))
+                kind = rng.choice(("/status", "cmd_status", "cmd_check"))
+                if kind.startswith("/"):
+                    payloads.append(_command_update(update_id, chat_id, kind))
+                else:
+                    payloads.append(_callback_update(update_id, chat_id, kind))
+            await asyncio.gather(*(timed(payload) for payload in payloads))
+        handler_upstream = loe.requests - requests_before_bursts
+    finally:
+        await bot.application.shutdown()
+        loe.close()
+        api.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "users": users,
+        "affected": len(affected),
+        "warmup_s": warmup,
+        "propagation_s": propagation,
+        "cycles": len(cycle_times),
+        "cycle_p50_s": percentile(cycle_times, 50),
+        "cycle_max_s": max(cycle_times) if cycle_times else 0.0,
+        "upstream_per_cycle": upstream_per_cycle,
+        "handler_count": len(latencies),
+        "handler_p50_ms": percentile(latencies, 50) * 1000,
+        "handler_p99_ms": percentile(latencies, 99) * 1000,
+        "handler_upstream": handler_upstream,
+        "bot_api_calls": dict(api.calls),
+    }
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return "не доставлено" if value is None else f"{value:.3f} с"
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(description="Офлайн навантажувальний тест бота із заглушками LOE та Bot API.")
+    arg_parser.add_argument("--users", type=int, default=1000, help="кількість синтетичних підписників")
+    arg_parser.add_argument("--changed-groups", type=int, default=2, help="скільки груп змінюється у сценарії")
+    arg_parser.add_argument("--bursts", type=int, default=5, help="кількість сплесків оновлень")
+    arg_parser.add_argument("--burst-size", type=int, default=50, help="оновлень в одному сплеску")
+    arg_parser.add_argument("--max-cycles", type=int, default=5, help="максимум перевірок на доставку зміни")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--json", action="store_true", help="вивести результат як JSON")
+    args = arg_parser.parse_args(argv)
+
+    # Every stub call is an httpx request; per-request INFO logs would drown the report.
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    result = asyncio.run(run_load_test(
+        users=args.users,
+        changed_groups=args.changed_groups,
+        bursts=args.bursts,
+        burst_size=args.burst_size,
+        max_cycles=args.max_cycles,
+        seed=args.seed,
+    ))
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0 if result["propagation_s"] is not None else 1
+
+    print(f"👥 Підписників: {result['users']}, зачеплено зміною: {result['affected']}")
+    print(f"🔥 Прогрів (перший графік усім): {_format_seconds(result['warmup_s'])}")
+    print(f"⏱ Від зміни в LOE до останнього сповіщення: {_format_seconds(result['propagation_s'])}")
+    print(
+        f"🔁 Перевірок: {result['cycles']}, p50 {result['cycle_p50_s']:.3f} с, max {result['cycle_max_s']:.3f} с; "
+        f"запитів до LOE за перевірку: {result['upstream_per_cycle']}"
+    )
+    print(
+        f"📨 Обробників: {result['handler_count']}, p50 {result['handler_p50_ms']:.1f} мс, "
+        f"p99 {result['handler_p99_ms']:.1f} мс; запитів до LOE від обробників: {result['handler_upstream']}"
+    )
+    print(f"🤖 Виклики Bot API: {result['bot_api_calls']}")
+    return 0 if result["propagation_s"] is not None else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,193 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Dict, List, Optional
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    # Upper bounds (ms) of the lag histogram buckets; the last bucket is "+Inf".
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(
+        self,
+        interval: float = Config.WATCHDOG_INTERVAL,
+        threshold: float = Config.WATCHDOG_LAG_THRESHOLD,
+        export_file: str = Config.WATCHDOG_EXPORT_FILE,
+        export_interval: float = Config.WATCHDOG_EXPORT_INTERVAL,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.export_file = export_file
+        self.export_interval = export_interval
+
+        self._lock = threading.Lock()
+        self._bucket_counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self._recent_lags = deque(maxlen=2048)
+        self._max_lag = 0.0
+        self._stalls = 0
+        # name -> [count, total seconds, max seconds, runs over threshold]
+        self._timings: Dict[str, List[float]] = {}
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._lag_task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        # Must be called from the event loop thread.
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._lag_task = asyncio.get_running_loop().create_task(self._measure_lag())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._lag_task:
+            self._lag_task.cancel()
+            try:
+                await self._lag_task
+            except asyncio.CancelledError:
+                pass
+        if self.export_file:
+            self.export()
+
+    def track(self, name: str, callback):
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            try:
+                return await callback(*args, **kwargs)
+            finally:
+                self._record_timing(name, time.monotonic() - started)
+
+        return wrapper
+
+    async def _measure_lag(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self._record_lag(max(0.0, now - expected))
+
+    def _watch(self):
+        reported_heartbeat = None
+        last_export = time.monotonic()
+
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            heartbeat = self._heartbeat
+            stalled = now - heartbeat - self.interval
+
+            # Sample the loop thread's stack while it is still blocked, once per stall.
+            if stalled > self.threshold and heartbeat != reported_heartbeat:
+                reported_heartbeat = heartbeat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame else "<no frame>"
+                logger.warning(
+                    "Event loop blocked for %.0f ms (still running), stack sample:\n%s",
+                    stalled * 1000, stack,
+                )
+
+            if self.export_file and now - last_export >= self.export_interval:
+                last_export = now
+                self.export()
+
+    def _record_lag(self, lag: float):
+        lag_ms = lag * 1000
+        bucket = len(self.BUCKETS_MS)
+        for i, bound in enumerate(self.BUCKETS_MS):
+            if lag_ms <= bound:
+                bucket = i
+                break
+
+        with self._lock:
+            self._bucket_counts[bucket] += 1
+            self._recent_lags.append(lag)
+            self._max_lag = max(self._max_lag, lag)
+            if lag > self.threshold:
+                self._stalls += 1
+
+    def _record_timing(self, name: str, elapsed: float):
+        with self._lock:
+            stats = self._timings.setdefault(name, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+            if elapsed > self.threshold:
+                stats[3] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            recent = sorted(self._recent_lags)
+            buckets = list(self._bucket_counts)
+            timings = {name: list(stats) for name, stats in self._timings.items()}
+            max_lag = self._max_lag
+            stalls = self._stalls
+
+        def pct(p: float) -> float:
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(p / 100 * len(recent)))] * 1000
+
+        bounds = [str(bound) for bound in self.BUCKETS_MS] + ["+Inf"]
+        return {
+            "lag_ms": {
+                "p50": pct(50),
+                "p99": pct(99),
+                "max": max_lag * 1000,
+                "stalls": stalls,
+                "buckets": dict(zip(bounds, buckets)),
+            },
+            "handlers": {
+                name: {
+                    "count": int(count),
+                    "avg_ms": total / count * 1000 if count else 0.0,
+                    "max_ms": longest * 1000,
+                    "slow": int(slow),
+                }
+                for name, (count, total, longest, slow) in timings.items()
+            },
+        }
+
+    def export(self) -> bool:
+        try:
+            tmp_path = f"{self.export_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.export_file)
+            return True
+        except OSError as e:
+            logger.warning("Failed to export watchdog stats: %s", e)
+            return False
+
+    def format_summary(self, top_n: int = 10) -> str:
+        snap = self.snapshot()
+        lag = snap["lag_ms"]
+        lines = [
+            f"⏱ Затримка циклу подій: p50 {lag['p50']:.1f} мс, p99 {lag['p99']:.1f} мс, "
+            f"max {lag['max']:.0f} мс, зависань > {self.threshold * 1000:.0f} мс: {lag['stalls']}",
+            "",
+            "Обробники (к-сть, avg, max, повільних):",
+        ]
+        handlers = sorted(snap["handlers"].items(), key=lambda kv: kv[1]["max_ms"], reverse=True)
+        for name, stats in handlers[:top_n]:
+            lines.append(
+                f"  {name}: {stats['count']}, {stats['avg_ms']:.0f} мс, {stats['max_ms']:.0f} мс, {stats['slow']}"
+            )
+        if not handlers:
+            lines.append("  —")
+        return "\n".join(lines)
@@ -0,0 +1,318 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from typing import Dict, Iterator, Optional, TextIO, Tuple
+from config import Config
+from data_manager import DeliveryPrefs
+
+READ_CHUNK_SIZE = 64 * 1024
+TIME_PATTERN = re.compile(r'^\d{1,2}:\d{2}$')
+
+FORMATS = ("json", "jsonl")
+
+
+class MigrationError(Exception):
+    pass
+
+
+def detect_format(path: str) -> str:
+    if path.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "json"
+
+
+# Longest token that can fail to decode when cut short: a "\uXXXX" escape.
+_MAX_PARTIAL_TOKEN = 6
+
+
+def _truncated(error: json.JSONDecodeError, buffer_size: int) -> bool:
+    # An unterminated string reports its opening quote, wherever the buffer ends.
+    return error.msg.startswith("Unterminated string") or buffer_size - error.pos <= _MAX_PARTIAL_TOKEN
+
+
+def iter_json_records(f: TextIO) -> Iterator[Tuple[str, object]]:
+    # Incremental reader for the DataManager file layout: one top-level object
+    # {"<chat_id>": {...}, ...}. Only the current record is kept in memory.
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        chunk = f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            eof = True
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def skip_ws():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or not fill():
+                return
+
+    def expect(char: str):
+        nonlocal pos
+        skip_ws()
+        if pos >= len(buf) or buf[pos] != char:
+            found = buf[pos] if pos < len(buf) else "EOF"
+            raise MigrationError(f"Очікувався '{char}', знайдено '{found}'")
+        pos += 1
+
+    def decode():
+        nonlocal pos
+        skip_ws()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # A value ending right at the buffer edge may be truncated (e.g. a number).
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                # Only a value cut off by the buffer edge is worth another chunk; anything else is
+                # corrupt, and reading on would copy the rest of the file into the buffer.
+                if eof or not _truncated(e, len(buf)):
+                    raise MigrationError(f"Некоректний JSON: {e}") from e
+            fill()
+
+    expect("{")
+    skip_ws()
+    if pos < len(buf) and buf[pos] == "}":
+        return
+
+    while True:
+        key = decode()
+        if not isinstance(key, str):
+            raise MigrationError("Ключ верхнього рівня має бути рядком")
+        expect(":")
+        yield key, decode()
+
+        skip_ws()
+        if pos < len(buf) and buf[pos] == ",":
+            pos += 1
+            continue
+        expect("}")
+        return
+
+
+def iter_jsonl_records(f: TextIO) -> Iterator[Tuple[object, object]]:
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise MigrationError(f"Рядок {line_no}: некоректний JSON: {e}") from e
+        if not isinstance(record, dict):
+            yield None, record
+            continue
+        record = dict(record)
+        yield record.pop("chat_id", None), record
+
+
+def _valid_schedule(schedule) -> bool:
+    if not isinstance(schedule, list):
+        return False
+    for interval in schedule:
+        if not (isinstance(interval, list) and len(interval) == 2):
+            return False
+        if not all(isinstance(t, str) and TIME_PATTERN.match(t) for t in interval):
+            return False
+    return True
+
+
+def _valid_delivery(delivery) -> bool:
+    if not isinstance(delivery, dict) or set(delivery) != set(DeliveryPrefs._fields):
+        return False
+    if delivery['mode'] not in ('immediate', 'digest'):
+        return False
+    minutes = delivery['digest_minutes']
+    if not isinstance(minutes, int) or isinstance(minutes, bool) or minutes < 0:
+        return False
+    for hour in (delivery['quiet_start'], delivery['quiet_end']):
+        if hour is not None and (not isinstance(hour, int) or isinstance(hour, bool) or not 0 <= hour < 24):
+            return False
+    return True
+
+
+def validate_record(chat_id, record) -> Tuple[Optional[int], Optional[Dict], Optional[str]]:
+    try:
+        chat_id_int = int(chat_id)
+    except (TypeError, ValueError):
+        return None, None, f"некоректний chat_id {chat_id!r}"
+
+    if not isinstance(record, dict):
+        return chat_id_int, None, "запис не є об'єктом"
+
+    group = record.get('group')
+    if group is not None and not isinstance(group, str):
+        return chat_id_int, None, "поле group має бути рядком"
+
+    if not _valid_schedule(record.get('last_schedule', [])):
+        return chat_id_int, None, "некоректне поле last_schedule"
+
+    pending = record.get('pending_schedule')
+    if pending is not None and not _valid_schedule(pending):
+        return chat_id_int, None, "некоректне поле pending_schedule"
+
+    pending_count = record.get('pending_count', 0) or 0
+    if not isinstance(pending_count, int) or pending_count < 0:
+        return chat_id_int, None, "некоректне поле pending_count"
+
+    delivery = record.get('delivery')
+    if delivery is not None and not _valid_delivery(delivery):
+        return chat_id_int, None, "некоректне поле delivery"
+
+    seen = record.get('seen_schedule')
+    if seen is not None and not _valid_schedule(seen):
+        return chat_id_int, None, "некоректне поле seen_schedule"
+
+    digest_due = record.get('digest_due')
+    if digest_due is not None and (not isinstance(digest_due, (int, float)) or isinstance(digest_due, bool)):
+        return chat_id_int, None, "некоректне поле digest_due"
+
+    return chat_id_int, record, None
+
+
+class _JsonWriter:
+    def __init__(self, f: TextIO):
+        self.f = f
+        self.first = True
+        f.write("{")
+
+    def write(self, chat_id: int, record: Dict):
+        self.f.write("\n" if self.first else ",\n")
+        self.first = False
+        self.f.write(f"  {json.dumps(str(chat_id))}: {json.dumps(record, ensure_ascii=False)}")
+
+    def close(self):
+        self.f.write("\n}\n" if not self.first else "}\n")
+
+
+class _JsonlWriter:
+    def __init__(self, f: TextIO):
+        self.f = f
+
+    def write(self, chat_id: int, record: Dict):
+        self.f.write(json.dumps({"chat_id": chat_id, **record}, ensure_ascii=False))
+        self.f.write("\n")
+
+    def close(self):
+        pass
+
+
+def migrate(
+    input_path: str,
+    output_path: str,
+    input_format: Optional[str] = None,
+    output_format: Optional[str] = None,
+    strict: bool = False,
+    progress_every: int = 100000,
+    log: TextIO = sys.stderr,
+) -> Dict[str, int]:
+    input_format = input_format or detect_format(input_path)
+    output_format = output_format or detect_format(output_path)
+    readers = {"json": iter_json_records, "jsonl": iter_jsonl_records}
+    writers = {"json": _JsonWriter, "jsonl": _JsonlWriter}
+
+    stats = {"read": 0, "written": 0, "invalid": 0, "duplicates": 0}
+    tmp_path = f"{output_path}.tmp"
+
+    try:
+        # Two passes over the input: the first finds the last valid record of every chat
+        # (json.load in DataManager also keeps the last duplicate key), the second writes them.
+        with open(input_path, 'r', encoding='utf-8') as src:
+            latest = _index_records(readers[input_format](src), stats, strict, progress_every, log)
+        with open(input_path, 'r', encoding='utf-8') as src, open(tmp_path, 'w', encoding='utf-8') as dst:
+            _copy_records(readers[input_format](src), writers[output_format](dst), latest, stats)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    os.replace(tmp_path, output_path)
+    return stats
+
+
+def _index_records(records, stats: Dict[str, int], strict: bool, progress_every: int, log: TextIO) -> Dict[int, int]:
+    # chat_id -> position of its last valid record; only ints are kept across records.
+    latest = {}
+    started = time.monotonic()
+
+    for position, (chat_id, record) in enumerate(records):
+        stats["read"] += 1
+
+        chat_id_int, record, error = validate_record(chat_id, record)
+        if error:
+            if strict:
+                raise MigrationError(f"Запис #{stats['read']} (chat_id={chat_id!r}): {error}")
+            stats["invalid"] += 1
+            log.write(f"⚠️ Пропущено запис #{stats['read']} (chat_id={chat_id!r}): {error}\n")
+        else:
+            latest[chat_id_int] = position
+
+        if progress_every and stats["read"] % progress_every == 0:
+            elapsed = time.monotonic() - started
+            log.write(f"… {stats['read']} записів ({stats['read'] / max(elapsed, 1e-9):.0f}/с)\n")
+    return latest
+
+
+def _copy_records(records, writer, latest: Dict[int, int], stats: Dict[str, int]):
+    for position, (chat_id, record) in enumerate(records):
+        chat_id_int, record, error = validate_record(chat_id, record)
+        if error:
+            continue
+        if latest.get(chat_id_int) != position:
+            stats["duplicates"] += 1
+            continue
+        writer.write(chat_id_int, record)
+        stats["written"] += 1
+    writer.close()
+
+
+def main(argv=None) -> int:
+    arg_parser = argparse.ArgumentParser(
+        description="Потокове перенесення даних користувачів між форматами JSON та JSONL."
+    )
+    arg_parser.add_argument("-i", "--input", default=Config.DATA_FILE, help=f"вхідний файл (типово {Config.DATA_FILE})")
+    arg_parser.add_argument("-o", "--output", required=True, help="вихідний файл")
+    arg_parser.add_argument("--input-format", choices=FORMATS, help="формат входу (типово за розширенням)")
+    arg_parser.add_argument("--output-format", choices=FORMATS, help="формат виходу (типово за розширенням)")
+    arg_parser.add_argument("--strict", action="store_true", help="зупинитися на першому некоректному записі")
+    arg_parser.add_argument("--progress-every", type=int, default=100000, help="звітувати кожні N записів (0 — вимкнути)")
+    args = arg_parser.parse_args(argv)
+
+    try:
+        stats = migrate(
+            args.input,
+            args.output,
+            input_format=args.input_format,
+            output_format=args.output_format,
+            strict=args.strict,
+            progress_every=args.progress_every,
+        )
+    except (MigrationError, OSError) as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+
+    print(
+        f"✅ Прочитано {stats['read']}, записано {stats['written']}, "
+        f"некоректних {stats['invalid']}, дублікатів {stats['duplicates']}"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class FloodWait(Exception):
+    # Raised by `send` when Telegram asks to back off; the entry keeps its attempts.
+    def __init__(self, retry_after: float):
+        super().__init__(f"retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class Undeliverable(Exception):
+    # Raised by `send` for errors that retrying will not fix (bot blocked, chat not found, ...).
+    pass
+
+
+class Outbox:
+    # Durable queue of confirmed notifications.
+    #
+    # `<path>` is an append-only JSONL log of message texts and pending deliveries, each with a
+    # unique sequence number; `<path>.delivered` journals "<seq> <key>" for every delivery as
+    # soon as Telegram accepts it. On start-up pending = outbox - journal, so a restart neither
+    # loses nor repeats deliveries.
+    # The last delivered key per chat is kept as well (and survives compaction): a change
+    # re-detected after a restart maps onto that key and is not enqueued again.
+    # Both files are compacted once the journal grows past the number of pending entries.
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        batch_size: int = Config.OUTBOX_BATCH_SIZE,
+        max_attempts: int = Config.OUTBOX_MAX_ATTEMPTS,
+        rate_limit: Optional[float] = None,
+    ):
+        self.path = path or Config.OUTBOX_FILE
+        self.journal_path = f"{self.path}.delivered"
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        # Sends per second across all chats; 0 disables pacing.
+        self.rate_limit = Config.OUTBOX_RATE_PER_SECOND if rate_limit is None else rate_limit
+        self._next_send = 0.0
+        self._flood_until = 0.0
+
+        # key -> [chat_id, message id, attempts, created, seq]; insertion order is delivery order
+        self._pending: Dict[str, list] = {}
+        self._next_seq = 0
+        self._messages: Dict[str, str] = {}
+        self._journal_size = 0
+        # journal lines written by the last compaction (the remembered keys)
+        self._journal_base = 0
+        self._journal = None
+        # chat_id -> (key, seq) of its last delivery, oldest chat first; bounded by Config.OUTBOX_DEDUP_CHATS
+        self._delivered: Dict[int, Tuple[str, int]] = {}
+        self._lock = asyncio.Lock()
+        self.delivered_total = 0
+        self.dropped_total = 0
+
+        self._load()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def oldest_age(self) -> float:
+        if not self._pending:
+            return 0.0
+        return time.time() - next(iter(self._pending.values()))[3]
+
+    @staticmethod
+    def make_key(chat_id: int, text: str) -> str:
+        # Idempotency key per (chat, version): the version is the content being delivered,
+        # so re-detecting the same change after a restart maps onto the same entry.
+        return f"{chat_id}:{Outbox._digest(text)}"
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=12).hexdigest()
+
+    def enqueue_many(self, items: List[Tuple[str, int, str]]) -> int:
+        lines = []
+        now = time.time()
+        for key, chat_id, text in items:
+            if key in self._pending:
+                continue
+            last = self._delivered.get(chat_id)
+            if last is not None and last[0] == key:
+                continue
+            message_id = self._digest(text)
+            if message_id not in self._messages:
+                self._messages[message_id] = text
+                lines.append({"message": message_id, "text": text})
+            self._pending[key] = [chat_id, message_id, 0, now, self._next_seq]
+            lines.append({"seq": self._next_seq, "key": key, "chat_id": chat_id, "message": message_id, "created": now})
+            self._next_seq += 1
+
+        if lines:
+            # One write for the whole cycle; entries stay queued in memory even if it fails.
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                logger.error("Failed to persist %d outbox entries: %s", len(items), e)
+        return sum(1 for line in lines if "key" in line)
+
+    async def drain(self, send, budget: Optional[float] = None) -> int:
+        # `send(chat_id, text)` must return True once the message is accepted, False on a transient
+        # failure, and raise FloodWait or Undeliverable. No new batch starts after `budget` seconds.
+        if self._lock.locked() or time.monotonic() < self._flood_until:
+            return 0
+
+        deadline = None if budget is None else time.monotonic() + budget
+        delivered = 0
+        async with self._lock:
+            # Chats are served concurrently in batches; each chat's entries go one at a time, in order.
+            chats: Dict[int, List[str]] = {}
+            for key, entry in self._pending.items():
+                chats.setdefault(entry[0], []).append(key)
+            queues = list(chats.values())
+            for start in range(0, len(queues), self.batch_size):
+                now = time.monotonic()
+                if now < self._flood_until or (deadline is not None and now >= deadline):
+                    break
+                results = await asyncio.gather(
+                    *(self._deliver_chat(keys, send) for keys in queues[start:start + self.batch_size])
+                )
+                delivered += sum(results)
+            self._journal_flush()
+            self._compact_if_needed()
+
+        if self._pending:
+            logger.info("Outbox depth after drain: %d (delivered %d)", len(self._pending), delivered)
+        return delivered
+
+    async def _deliver_chat(self, keys: List[str], send) -> int:
+        # Each entry is attempted at most once per drain. After a failure the chat's later entries
+        # wait for the next drain, so an older diff never arrives after a newer one.
+        delivered = 0
+        for key in keys:
+            entry = self._pending.get(key)
+            if entry is None:
+                continue
+            await self._pace()
+            if time.monotonic() < self._flood_until:
+                break
+            if not await self._deliver(key, entry, send):
+                break
+            delivered += 1
+        return delivered
+
+    async def _pace(self):
+        # Each send reserves the next free slot, so concurrent chats share one rate.
+        if not self.rate_limit:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_send)
+        self._next_send = slot + 1 / self.rate_limit
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _deliver(self, key: str, entry: list, send) -> bool:
+        chat_id, message_id, attempts, created, seq = entry
+        permanent = False
+        try:
+            ok = await send(chat_id, self._messages[message_id])
+        except FloodWait as e:
+            # Stop sending until Telegram allows it again; this is not the entry's fault.
+            self._flood_until = max(self._flood_until, time.monotonic() + e.retry_after)
+            logger.warning("Telegram flood control, pausing the outbox for %s s", e.retry_after)
+            return False
+        except Undeliverable as e:
+            ok = False
+            permanent = True
+        except Exception as e:
+            ok = False
+
+        if ok:
+            self._ack(key, chat_id, seq)
+            self.delivered_total += 1
+            return True
+
+        # Only permanent errors use up attempts; transient ones retry until the entry is too old.
+        if permanent:
+            entry[2] = attempts + 1
+        if entry[2] >= self.max_attempts or time.time() - created > Config.OUTBOX_MAX_AGE:
+            logger.warning("Dropping outbox entry %s after %d attempts", key, entry[2])
+            self._ack(key, chat_id, seq)
+            self.dropped_total += 1
+        return False
+
+    def _remember(self, chat_id: int, key: str, seq: int):
+        self._delivered.pop(chat_id, None)
+        self._delivered[chat_id] = (key, seq)
+        if len(self._delivered) > Config.OUTBOX_DEDUP_CHATS:
+            del self._delivered[next(iter(self._delivered))]
+
+    def _ack(self, key: str, chat_id: int, seq: int):
+        self._pending.pop(key, None)
+        self._remember(chat_id, key, seq)
+        try:
+            if self._journal is None:
+                self._journal = open(self.journal_path, 'a', encoding='utf-8')
+            # Flushed per delivery so a crash right after sending cannot resend it.
+            self._journal.write(f"{seq} {key}\n")
+            self._journal.flush()
+            self._journal_size += 1
+        except OSError as e:
+            logger.error("Failed to journal outbox delivery %s: %s", key, e)
+
+    def _journal_flush(self):
+        if self._journal is not None:
+            try:
+                os.fsync(self._journal.fileno())
+            except OSError:
+                pass
+
+    def _compact_if_needed(self):
+        grown = self._journal_size - self._journal_base
+        if not grown or (self._pending and grown <= max(1000, len(self._pending))):
+            return
+
+        referenced = {entry[1] for entry in self._pending.values()}
+        self._messages = {mid: text for mid, text in self._messages.items() if mid in referenced}
+
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for message_id, text in self._messages.items():
+                    f.write(json.dumps({"message": message_id, "text": text}, ensure_ascii=False) + "\n")
+                for key, (chat_id, message_id, attempts, created, seq) in self._pending.items():
+                    f.write(json.dumps({"seq": seq, "key": key, "chat_id": chat_id, "message": message_id, "created": created}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            # The outbox is replaced before the journal is cleared: a crash in between only
+            # leaves journaled sequence numbers that no longer match any entry.
+            os.replace(tmp_path, self.path)
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            # The journal keeps only the remembered per-chat keys; their sequence numbers no
+            # longer match any outbox entry.
+            with open(f"{self.journal_path}.tmp", 'w', encoding='utf-8') as f:
+                f.write("".join(f"{seq} {key}\n" for key, seq in self._delivered.values()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(f"{self.journal_path}.tmp", self.journal_path)
+            self._journal_size = self._journal_base = len(self._delivered)
+        except OSError as e:
+            logger.error("Failed to compact outbox: %s", e)
+
+    def _load(self):
+        delivered = set()
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    seq, _, key = line.strip().partition(" ")
+                    if not seq.isdigit():
+                        continue
+                    delivered.add(int(seq))
+                    chat_id = key.rpartition(":")[0]
+                    if chat_id.lstrip("-").isdigit():
+                        self._remember(int(chat_id), key, int(seq))
+            self._journal_size = len(delivered)
+            self._journal_base = len(self._delivered)
+        self._next_seq = max(delivered, default=-1) + 1
+
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a crash mid-append.
+                    continue
+                if "text" in record:
+                    self._messages[record["message"]] = record["text"]
+                elif "seq" in record:
+                    seq = int(record["seq"])
+                    self._next_seq = max(self._next_seq, seq + 1)
+                    if seq not in delivered:
+                        self._pending[record["key"]] = [
+                            int(record["chat_id"]), record["message"], 0, record.get("created", time.time()), seq
+                        ]
+
+        # Entries whose message line was torn cannot be delivered.
+        for key in [key for key, entry in self._pending.items() if entry[1] not in self._messages]:
+            del self._pending[key]
+
+        if self._pending:
+            logger.info("Outbox resumed with %d pending deliveries", len(self._pending))
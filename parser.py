@@ -1,27 +1,29 @@
-import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
-from bs4 import BeautifulSoup
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from config import Config
+from providers import PROVIDERS, LoeProvider, ScheduleProvider
 
 class PowerOnParser:
-    def __init__(self):
+    def __init__(self, providers: Optional[List[ScheduleProvider]] = None):
+        # One session (and connection pool) shared by all providers.
         self.session = requests.Session()
-        
+
         retry_strategy = Retry(
             total=Config.MAX_RETRIES,
             backoff_factor=1,
             status_forcelist=[429, 500, 502, 503, 504],
             allowed_methods=["GET"]
         )
-        
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+
+        adapter = HTTPAdapter(max_retries=retry_strategy, pool_maxsize=Config.HTTP_POOL_SIZE)
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
-        
+
         self.session.headers.update({
             'User-Agent': Config.USER_AGENT,
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -31,178 +33,133 @@ class PowerOnParser:
             'Upgrade-Insecure-Requests': '1',
         })
 
-    def _fetch_api_schedule_html(self) -> Optional[str]:
-        try:
-            url = (
-                f"{Config.LOE_API_BASE_URL}{Config.LOE_API_PREFIX}/menus"
-                f"?page=1&type={Config.LOE_API_SCHEDULE_MENU_TYPE}"
-            )
-            resp = self.session.get(url, timeout=Config.REQUEST_TIMEOUT)
-            resp.raise_for_status()
-
-            data = resp.json()
-            members = data.get("hydra:member") or []
-            if not members:
-                return None
-
-            menu = members[0]
-            items = menu.get("menuItems") or []
-            if not items:
-                return None
-
-            # Prefer the entry named 'Today' if present, otherwise first item.
-            today = None
-            for it in items:
-                if str(it.get("name", "")).strip().lower() == "today":
-                    today = it
-                    break
-
-            item = today or items[0]
-            raw_html = item.get("rawHtml") or item.get("rawMobileHtml")
-            if isinstance(raw_html, str) and raw_html.strip():
-                return raw_html
-
+        if providers is None:
+            providers = [PROVIDERS[pid]() for pid in Config.SCHEDULE_PROVIDERS if pid in PROVIDERS]
+        self.providers: List[ScheduleProvider] = providers or [PROVIDERS["loe"]()]
+        self._providers_by_id = {provider.id: provider for provider in self.providers}
+        # Groups saved before providers existed have no namespace; they were always LOE groups,
+        # whatever order SCHEDULE_PROVIDERS lists the providers in.
+        self.legacy_provider_id = LoeProvider.id
+        # A fetch can outlive its poll_timeout (per-request timeout x retries, then the fallback URL)
+        # and keep its worker busy; spare workers keep later polls from queueing behind it.
+        self._executor = ThreadPoolExecutor(
+            max_workers=Config.PROVIDER_FETCH_WORKERS * len(self.providers), thread_name_prefix="schedule-provider"
+        )
+        # Fetches run in worker threads; provider parse caches are updated under this lock.
+        self.lock = threading.RLock()
+
+    @property
+    def chunk_hashes(self) -> Dict[str, str]:
+        return {
+            f"{provider.id}:{group}": digest
+            for provider in self.providers
+            for group, digest in provider.chunk_hashes.items()
+        }
+
+    def qualify_group(self, group: str) -> str:
+        if ':' in group:
+            return group
+        return f"{self.legacy_provider_id}:{group}"
+
+    def split_group(self, group: str) -> Tuple[Optional[ScheduleProvider], str]:
+        provider_id, _, local_group = self.qualify_group(group).partition(':')
+        return self._providers_by_id.get(provider_id), local_group
+
+    def group_label(self, group: str) -> str:
+        provider, local_group = self.split_group(group)
+        if provider is None or len(self.providers) == 1:
+            return local_group
+        return f"{provider.title} {local_group}"
+
+    def _poll(self, providers: List[ScheduleProvider]) -> Dict[str, Optional[str]]:
+        started = time.monotonic()
+        futures = {provider.id: self._executor.submit(provider.fetch, self.session) for provider in providers}
+
+        pages = {}
+        for provider in providers:
+            # A provider that misses its deadline is treated as a failed fetch for this poll;
+            # the request itself is still bounded by the provider's per-request timeout.
+            remaining = provider.poll_timeout - (time.monotonic() - started)
+            try:
+                pages[provider.id] = futures[provider.id].result(timeout=max(0.0, remaining))
+            except Exception:
+                pages[provider.id] = None
+        return pages
+
+    def _parse_pages(self, pages: Dict[str, Optional[str]]) -> Optional[Dict[str, List[List[str]]]]:
+        schedule_data = {}
+        fetched = False
+
+        with self.lock:
+            for provider in self.providers:
+                html_content = pages.get(provider.id)
+                if not html_content:
+                    continue
+                fetched = True
+
+                # Providers reuse cached interval lists; callers get their own copies.
+                for group, intervals in provider.parse(html_content).items():
+                    schedule_data[f"{provider.id}:{group}"] = [list(interval) for interval in intervals]
+        return schedule_data if fetched else None
+
+    def get_provider_schedules(self, provider_id: str) -> Optional[Dict[str, List[List[str]]]]:
+        provider = self._providers_by_id.get(provider_id)
+        if provider is None:
             return None
-        except Exception:
+        return self._parse_pages(self._poll([provider]))
+
+    def get_group_schedule(self, group: str) -> Optional[List[List[str]]]:
+        provider, _ = self.split_group(group)
+        if provider is None:
             return None
-    
-    def fetch_page(self) -> Optional[str]:
-        if Config.USE_TEST_DATA:
-            from test_data import TEST_SCHEDULE_DATA
-            return TEST_SCHEDULE_DATA
-
-        api_html = self._fetch_api_schedule_html()
-        if api_html:
-            return api_html
-        
-        try:
-            response = self.session.get(
-                Config.POWERON_URL,
-                timeout=Config.REQUEST_TIMEOUT
-            )
-            response.raise_for_status()
-            
-            # Ensure proper encoding
-            response.encoding = response.apparent_encoding or 'utf-8'
-            
-            return response.text
-        except requests.exceptions.RequestException as e:
+
+        schedule_data = self.get_provider_schedules(provider.id)
+        if schedule_data is None:
             return None
-    
-    def parse_schedule(self, html_content: str) -> Dict[str, List[List[str]]]:
-        if not html_content:
-            return {}
-        
-        soup = BeautifulSoup(html_content, 'lxml')
-        
-        schedule_data = {}
+        return schedule_data.get(self.qualify_group(group))
 
-        # LOE API `rawHtml` sometimes has multiple groups concatenated in one block.
-        # Parse by splitting the plain text into per-group chunks.
-        text_content = soup.get_text(" ", strip=True)
-        if not text_content:
-            return {}
+    def get_all_schedules(self) -> Optional[Dict[str, List[List[str]]]]:
+        return self._parse_pages(self._poll(self.providers))
 
-        group_chunk_pattern = re.compile(
-            r'(Група\s+\d+\.\d+\.?\s*.*?)(?=\s*Група\s+\d+\.\d+\.?\s*|$)',
-            re.IGNORECASE | re.UNICODE | re.DOTALL,
-        )
+    def get_all_schedules_with_hashes(self) -> Tuple[Optional[Dict[str, List[List[str]]]], Dict[str, str]]:
+        # The network poll runs unlocked; parsing and the hash read happen under one lock, so a
+        # concurrent fetch cannot leave the hashes describing a different page than the schedules.
+        pages = self._poll(self.providers)
+        with self.lock:
+            return self._parse_pages(pages), self.chunk_hashes
 
-        for chunk in group_chunk_pattern.findall(text_content):
-            m = re.search(r'Група\s+(\d+\.\d+)\.?', chunk, re.IGNORECASE | re.UNICODE)
-            if not m:
-                continue
-
-            group = m.group(1)
-            intervals = self._parse_time_intervals(chunk)
-            if intervals:
-                schedule_data[group] = intervals
-
-        # Fallback: strict pattern
-        if not schedule_data:
-            group_pattern = r'Група\s+(\d+\.\d+)\.?\s*Електроенергії\s+немає\s+з\s+([^.]*)\.?'
-            matches = re.findall(group_pattern, text_content, re.IGNORECASE | re.UNICODE)
-
-            for group, time_str in matches:
-                time_intervals = self._parse_time_intervals(time_str)
-                if time_intervals:
-                    schedule_data[group] = time_intervals
-
-        return schedule_data
-    
-    def _parse_time_intervals(self, time_str: str) -> List[List[str]]:
-        intervals = []
-        
-        time_pattern = r'(\d{1,2}):(\d{2})\s*до\s*(\d{1,2}):(\d{2})'
-        
-        matches = re.findall(time_pattern, time_str, re.IGNORECASE)
-        
-        for start_h, start_m, end_h, end_m in matches:
-            start_time = f"{int(start_h):02d}:{start_m}"
-            end_time = f"{int(end_h):02d}:{end_m}"
-            
-            if end_time == "24:00":
-                end_time = "23:59"
-            
-            intervals.append([start_time, end_time])
-        
-        return intervals
-    
-    def get_group_schedule(self, group: str) -> Optional[List[List[str]]]:
-        html_content = self.fetch_page()
-        if not html_content:
-            return None
-        
-        schedule_data = self.parse_schedule(html_content)
-        return schedule_data.get(group)
-    
-    def get_all_schedules(self) -> Optional[Dict[str, List[List[str]]]]:
-        html_content = self.fetch_page()
-        if not html_content:
-            return None
-        
-        return self.parse_schedule(html_content)
-    
     def get_available_groups(self) -> List[str]:
-        schedules = self.get_all_schedules()
-        if schedules:
-            keys = sorted(schedules.keys(), key=lambda x: (int(x.split('.')[0]), int(x.split('.')[1])))
-            if keys:
-                return keys
-
-        html_content = self.fetch_page()
-        if not html_content:
-            return list(Config.FALLBACK_GROUPS)
-
-        soup = BeautifulSoup(html_content, 'lxml')
-        text_content = soup.get_text()
-
-        group_patterns = [
-            r'Група\s+(\d+\.\d+)\.?\s*Електроенергії\s+немає',
-            r'Група\s+(\d+\.\d+)\.?',
-        ]
-
-        matches: List[str] = []
-        for pattern in group_patterns:
-            matches.extend(re.findall(pattern, text_content, re.IGNORECASE | re.UNICODE))
-
-        unique = sorted(set(matches), key=lambda x: (int(x.split('.')[0]), int(x.split('.')[1])))
-        return unique or list(Config.FALLBACK_GROUPS)
-    
+        pages = self._poll(self.providers)
+
+        available = []
+        for provider in self.providers:
+            html_content = pages.get(provider.id)
+            groups = []
+            if html_content:
+                with self.lock:
+                    groups = sorted(provider.parse(html_content).keys(), key=provider.group_sort_key)
+                if not groups:
+                    groups = provider.extract_groups(html_content)
+            if not groups:
+                groups = list(provider.fallback_groups)
+            available.extend(f"{provider.id}:{group}" for group in groups)
+
+        return available
+
     def normalize_time_format(self, time_str: str) -> str:
         if ':' not in time_str:
             return time_str
-        
+
         hours, minutes = time_str.split(':')
         return f"{int(hours):02d}:{minutes}"
-    
+
     def normalize_schedule(self, schedule: List[List[str]]) -> List[List[str]]:
         normalized = []
         for start, end in schedule:
             normalized_start = self.normalize_time_format(start)
             normalized_end = self.normalize_time_format(end)
             normalized.append([normalized_start, normalized_end])
-        
+
         normalized.sort(key=lambda x: x[0])
-        
+
         return normalized
@@ -0,0 +1,189 @@
+import cProfile
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+from config import Config
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Only frames from these modules are reported (PowerOnParser and its providers, DataManager, ScheduleMonitor).
+_TARGET_FILES = tuple(
+    os.path.join(_PROJECT_DIR, name)
+    for name in ("parser.py", "providers.py", "data_manager.py", "scheduler.py")
+)
+
+# Allocations made inside bs4/lxml/json are attributed to the innermost project frame that called them.
+_TRACEMALLOC_FRAMES = 25
+
+
+class CycleProfiler:
+    def __init__(self, top_n: int = Config.PROFILE_TOP_N, output_dir: str = Config.PROFILE_DIR):
+        self.top_n = top_n
+        self.output_dir = output_dir
+        self._remaining = 0
+        self._cycles_done = 0
+        self._requested_by: Optional[int] = None
+        self._save = False
+        self._in_cycle = False
+        self._profile: Optional[cProfile.Profile] = None
+        self._alloc_totals = {}
+        self._peak_bytes = 0
+        self._wall_time = 0.0
+        self._report: Optional[Tuple[int, str]] = None
+
+    @property
+    def active(self) -> bool:
+        return self._remaining > 0
+
+    def arm(self, cycles: int, requested_by: int, save: bool = False):
+        self._reset()
+        self._remaining = max(1, cycles)
+        self._requested_by = requested_by
+        self._save = save
+        self._profile = cProfile.Profile()
+
+    def stop(self) -> Optional[str]:
+        if not self.active:
+            return None
+        # Report whatever was collected so far, even if fewer cycles ran than requested.
+        text = self._build_report() if self._cycles_done else None
+        self._reset()
+        return text
+
+    @contextmanager
+    def cycle(self):
+        # Fast path: nothing is armed (or a cycle is already being profiled), run as is.
+        if not self._remaining or self._in_cycle:
+            yield
+            return
+
+        profile = self._profile
+        self._in_cycle = True
+        owns_tracemalloc = not tracemalloc.is_tracing()
+        if owns_tracemalloc:
+            tracemalloc.start(_TRACEMALLOC_FRAMES)
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            if owns_tracemalloc:
+                tracemalloc.stop()
+            self._in_cycle = False
+            # Skip bookkeeping if /profile stop (or a re-arm) happened while this cycle was running.
+            if profile is self._profile:
+                self._finish_cycle(time.perf_counter() - started, snapshot, peak_bytes)
+
+    @contextmanager
+    def paused(self):
+        # Wrap awaits inside a cycle: handlers running meanwhile must not land in the cycle's profile.
+        profile = self._profile if self._in_cycle else None
+        if profile is not None:
+            profile.disable()
+        try:
+            yield
+        finally:
+            if profile is not None and profile is self._profile:
+                profile.enable()
+
+    def run(self, func, *args):
+        # Runs func under the cycle's profile in the calling thread, for cycle work handed to a
+        # worker thread while the loop thread's profile is paused.
+        profile = self._profile if self._in_cycle else None
+        if profile is None:
+            return func(*args)
+        profile.enable()
+        try:
+            return func(*args)
+        finally:
+            profile.disable()
+
+    def pop_report(self) -> Optional[Tuple[int, str]]:
+        report, self._report = self._report, None
+        return report
+
+    def _finish_cycle(self, wall_time: float, snapshot: tracemalloc.Snapshot, peak_bytes: int):
+        self._wall_time += wall_time
+        self._peak_bytes = max(self._peak_bytes, peak_bytes)
+        self._collect_allocations(snapshot)
+        self._cycles_done += 1
+        self._remaining -= 1
+        if not self._remaining:
+            self._report = (self._requested_by, self._build_report())
+            self._reset()
+
+    def _collect_allocations(self, snapshot: tracemalloc.Snapshot):
+        snapshot = snapshot.filter_traces(
+            [tracemalloc.Filter(True, path, all_frames=True) for path in _TARGET_FILES]
+        )
+        for stat in snapshot.statistics("traceback"):
+            # Frames run from the oldest call to the allocation site.
+            frame = next(frame for frame in reversed(stat.traceback) if frame.filename in _TARGET_FILES)
+            key = (frame.filename, frame.lineno)
+            size, count = self._alloc_totals.get(key, (0, 0))
+            self._alloc_totals[key] = (size + stat.size, count + stat.count)
+
+    def _build_report(self) -> str:
+        lines = [
+            f"🧪 Профіль {self._cycles_done} перевірок, "
+            f"{self._wall_time:.2f} с загалом, пік пам'яті {self._peak_bytes / 1024:.0f} KiB",
+            "",
+            f"Топ-{self.top_n} за сумарним часом (cumtime, ncalls):",
+        ]
+        lines.extend(self._format_time_stats())
+
+        lines.append("")
+        lines.append(f"Топ-{self.top_n} алокацій (залишок на кінець перевірки):")
+        top_allocs = sorted(self._alloc_totals.items(), key=lambda kv: kv[1][0], reverse=True)
+        for (filename, lineno), (size, count) in top_allocs[:self.top_n]:
+            lines.append(f"{size / 1024:8.1f} KiB {count:6d}  {os.path.basename(filename)}:{lineno}")
+        if not top_allocs:
+            lines.append("  —")
+
+        if self._save:
+            path = self._dump_profile()
+            lines.append("")
+            lines.append(f"💾 {path}" if path else "⚠️ Не вдалося зберегти профіль")
+
+        return "\n".join(lines)
+
+    def _format_time_stats(self) -> List[str]:
+        stats = pstats.Stats(self._profile).stats
+        rows = [
+            (ct, nc, filename, lineno, funcname)
+            for (filename, lineno, funcname), (cc, nc, tt, ct, callers) in stats.items()
+            if filename in _TARGET_FILES
+        ]
+        rows.sort(key=lambda row: row[0], reverse=True)
+
+        if not rows:
+            return ["  —"]
+        return [
+            f"{ct:8.3f} s {nc:6d}  {os.path.basename(filename)}:{lineno}({funcname})"
+            for ct, nc, filename, lineno, funcname in rows[:self.top_n]
+        ]
+
+    def _dump_profile(self) -> Optional[str]:
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            path = os.path.join(self.output_dir, f"cycle-{time.strftime('%Y%m%d-%H%M%S')}.prof")
+            self._profile.dump_stats(path)
+            return path
+        except OSError:
+            return None
+
+    def _reset(self):
+        self._remaining = 0
+        self._cycles_done = 0
+        self._requested_by = None
+        self._save = False
+        self._profile = None
+        self._alloc_totals = {}
+        self._peak_bytes = 0
+        self._wall_time = 0.0
@@ -0,0 +1,212 @@
+import hashlib
+import re
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+from bs4 import BeautifulSoup
+import requests
+from config import Config
+
+_GROUP_CHUNK_PATTERN = re.compile(
+    r'(Група\s+\d+\.\d+\.?\s*.*?)(?=\s*Група\s+\d+\.\d+\.?\s*|$)',
+    re.IGNORECASE | re.UNICODE | re.DOTALL,
+)
+_GROUP_HEADER_PATTERN = re.compile(r'Група\s+(\d+\.\d+)\.?', re.IGNORECASE | re.UNICODE)
+
+
+class ScheduleProvider(ABC):
+    # Short stable id used to namespace groups ("<id>:<group>"); never change it once users subscribed.
+    id = ""
+    title = ""
+    # Per-request timeout and overall budget for one fetch (including retries and fallbacks).
+    timeout = Config.REQUEST_TIMEOUT
+    poll_timeout = Config.PROVIDER_POLL_TIMEOUT
+    fallback_groups: List[str] = []
+
+    def __init__(self):
+        # Parsed intervals keyed by chunk digest, reused while a group's text is unchanged.
+        self._chunk_cache: Dict[str, List[List[str]]] = {}
+        # group -> digest of its chunk in the latest successful parse
+        self.chunk_hashes: Dict[str, str] = {}
+
+    @abstractmethod
+    def fetch(self, session: requests.Session) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def parse(self, html_content: str) -> Dict[str, List[List[str]]]:
+        pass
+
+    def extract_groups(self, html_content: str) -> List[str]:
+        return []
+
+    def group_sort_key(self, group: str):
+        return tuple(int(part) if part.isdigit() else part for part in re.split(r'[.\-]', group))
+
+    def _reuse_chunks(self, chunks: List[Tuple[str, str]], parse_chunk, chunk_cache: Dict, chunk_hashes: Dict):
+        # Runs parse_chunk only for chunks whose digest was not seen in the previous parse.
+        schedule_data = {}
+
+        for group, chunk in chunks:
+            digest = self._chunk_digest(chunk)
+            intervals = chunk_cache.get(digest)
+            if intervals is None:
+                intervals = self._chunk_cache.get(digest)
+            if intervals is None:
+                intervals = parse_chunk(chunk)
+            chunk_cache[digest] = intervals
+
+            if intervals:
+                schedule_data[group] = intervals
+                chunk_hashes[group] = digest
+
+        return schedule_data
+
+    def _remember(self, chunk_cache: Dict[str, List[List[str]]], chunk_hashes: Dict[str, str]):
+        self._chunk_cache = chunk_cache
+        self.chunk_hashes = chunk_hashes
+
+    @staticmethod
+    def _chunk_digest(chunk: str) -> str:
+        return hashlib.blake2b(chunk.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class LoeProvider(ScheduleProvider):
+    id = "loe"
+    title = "ЛОЕ"
+    fallback_groups = Config.FALLBACK_GROUPS
+
+    def _fetch_api_schedule_html(self, session: requests.Session) -> Optional[str]:
+        try:
+            url = (
+                f"{Config.LOE_API_BASE_URL}{Config.LOE_API_PREFIX}/menus"
+                f"?page=1&type={Config.LOE_API_SCHEDULE_MENU_TYPE}"
+            )
+            resp = session.get(url, timeout=self.timeout)
+            resp.raise_for_status()
+
+            data = resp.json()
+            members = data.get("hydra:member") or []
+            if not members:
+                return None
+
+            menu = members[0]
+            items = menu.get("menuItems") or []
+            if not items:
+                return None
+
+            # Prefer the entry named 'Today' if present, otherwise first item.
+            today = None
+            for it in items:
+                if str(it.get("name", "")).strip().lower() == "today":
+                    today = it
+                    break
+
+            item = today or items[0]
+            raw_html = item.get("rawHtml") or item.get("rawMobileHtml")
+            if isinstance(raw_html, str) and raw_html.strip():
+                return raw_html
+
+            return None
+        except Exception:
+            return None
+
+    def fetch(self, session: requests.Session) -> Optional[str]:
+        if Config.USE_TEST_DATA:
+            from test_data import TEST_SCHEDULE_DATA
+            return TEST_SCHEDULE_DATA
+
+        api_html = self._fetch_api_schedule_html(session)
+        if api_html:
+            return api_html
+
+        try:
+            response = session.get(
+                Config.POWERON_URL,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+
+            # Ensure proper encoding
+            response.encoding = response.apparent_encoding or 'utf-8'
+
+            return response.text
+        except requests.exceptions.RequestException as e:
+            return None
+
+    def parse(self, html_content: str) -> Dict[str, List[List[str]]]:
+        if not html_content:
+            return {}
+
+        soup = BeautifulSoup(html_content, 'lxml')
+
+        # LOE API `rawHtml` sometimes has multiple groups concatenated in one block.
+        # Parse by splitting the plain text into per-group chunks.
+        text_content = soup.get_text(" ", strip=True)
+        if not text_content:
+            return {}
+
+        chunk_cache = {}
+        chunk_hashes = {}
+        schedule_data = self._reuse_chunks(
+            self._split_group_chunks(text_content), self._parse_time_intervals, chunk_cache, chunk_hashes
+        )
+
+        # Fallback: strict pattern
+        if not schedule_data:
+            group_pattern = r'Група\s+(\d+\.\d+)\.?\s*Електроенергії\s+немає\s+з\s+([^.]*)\.?'
+            matches = re.findall(group_pattern, text_content, re.IGNORECASE | re.UNICODE)
+
+            for group, time_str in matches:
+                time_intervals = self._parse_time_intervals(time_str)
+                if time_intervals:
+                    schedule_data[group] = time_intervals
+                    chunk_hashes[group] = self._chunk_digest(time_str)
+
+        self._remember(chunk_cache, chunk_hashes)
+        return schedule_data
+
+    def _split_group_chunks(self, text_content: str) -> List[Tuple[str, str]]:
+        chunks = []
+        for chunk in _GROUP_CHUNK_PATTERN.findall(text_content):
+            m = _GROUP_HEADER_PATTERN.search(chunk)
+            if m:
+                chunks.append((m.group(1), chunk))
+        return chunks
+
+    def _parse_time_intervals(self, time_str: str) -> List[List[str]]:
+        intervals = []
+
+        time_pattern = r'(\d{1,2}):(\d{2})\s*до\s*(\d{1,2}):(\d{2})'
+
+        matches = re.findall(time_pattern, time_str, re.IGNORECASE)
+
+        for start_h, start_m, end_h, end_m in matches:
+            start_time = f"{int(start_h):02d}:{start_m}"
+            end_time = f"{int(end_h):02d}:{end_m}"
+
+            if end_time == "24:00":
+                end_time = "23:59"
+
+            intervals.append([start_time, end_time])
+
+        return intervals
+
+    def extract_groups(self, html_content: str) -> List[str]:
+        soup = BeautifulSoup(html_content, 'lxml')
+        text_content = soup.get_text()
+
+        group_patterns = [
+            r'Група\s+(\d+\.\d+)\.?\s*Електроенергії\s+немає',
+            r'Група\s+(\d+\.\d+)\.?',
+        ]
+
+        matches: List[str] = []
+        for pattern in group_patterns:
+            matches.extend(re.findall(pattern, text_content, re.IGNORECASE | re.UNICODE))
+
+        return sorted(set(matches), key=self.group_sort_key)
+
+
+PROVIDERS = {
+    LoeProvider.id: LoeProvider,
+}
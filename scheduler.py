@@ -1,68 +1,314 @@
 import asyncio
-from typing import List, Optional, Dict
+import logging
+import time
+from typing import List, Optional, Dict, Tuple
 from datetime import datetime
-from data_manager import DataManager
+from zoneinfo import ZoneInfo
+from data_manager import DataManager, DeliveryPrefs
+from outbox import Outbox
 from parser import PowerOnParser
+from profiler import CycleProfiler
 from config import Config
 
+logger = logging.getLogger(__name__)
+
 class ScheduleMonitor:
     def __init__(self, data_manager: DataManager, parser: PowerOnParser):
         self.data_manager = data_manager
         self.parser = parser
         self.bot = None
-        self._monitoring_task = None
-        self._stop_event = asyncio.Event()
         self._required_confirmations = 2
+        self.profiler = CycleProfiler()
+        self.outbox = Outbox()
+        # chat_id -> (group, chunk digest) the user's saved schedule was last confirmed against
+        self._verified: Dict[int, tuple] = {}
+        try:
+            self._tz = ZoneInfo(Config.TIMEZONE)
+        except Exception as e:
+            # No tz database on the host: fall back to the server's local time.
+            self._tz = None
+        
+        # Only one cycle at a time; chats a cycle did not reach before its deadline go first next time.
+        self._cycle_lock = asyncio.Lock()
+        self._cycle_started: Optional[float] = None
+        self._backlog: List[str] = []
+        self.cycles_total = 0
+        self.cycles_skipped = 0
+        self.overruns = 0
+        self.last_cycle_duration = 0.0
+        self.max_cycle_duration = 0.0
+        self.last_start_lag = 0.0
+        self.max_start_lag = 0.0
+        
+        # Interactive checks: one upstream fetch per provider at a time and one debounce step per chat
+        # and fetch. Results are reused for INTERACTIVE_COOLDOWN_SECONDS.
+        self._provider_fetches: Dict[str, asyncio.Future] = {}
+        self._provider_snapshots: Dict[str, tuple] = {}  # provider id -> (fetched at, schedules by group)
+        self._chat_checks: Dict[int, asyncio.Future] = {}
+        self._chat_results: Dict[int, tuple] = {}  # chat_id -> (checked at, group, result)
     
-    def start_monitoring(self, bot):
-        self.bot = bot
-        self._stop_event.clear()
-        import asyncio
-        self._monitoring_task = asyncio.create_task(self._monitor_loop())
-    
-    async def stop_monitoring(self):
-        self._stop_event.set()
-        if self._monitoring_task:
-            self._monitoring_task.cancel()
+    async def check_all_users(self, scheduled_at: Optional[float] = None) -> bool:
+        # scheduled_at: wall-clock time this run was due, when it comes from the job queue.
+        if self._cycle_lock.locked():
+            self.cycles_skipped += 1
+            logger.warning(
+                "Check cycle still running after %.0f s, skipping this run",
+                time.monotonic() - self._cycle_started,
+            )
+            return False
+        
+        async with self._cycle_lock:
+            started = time.monotonic()
+            if scheduled_at is not None:
+                self.last_start_lag = max(0.0, time.time() - scheduled_at)
+                self.max_start_lag = max(self.max_start_lag, self.last_start_lag)
+                if self.last_start_lag > Config.CHECK_INTERVAL_MINUTES * 60 / 2:
+                    logger.warning("Check cycle started %.0f s behind schedule", self.last_start_lag)
+            self._cycle_started = started
+            self.cycles_total += 1
+            
             try:
-                await self._monitoring_task
-            except asyncio.CancelledError:
-                pass
+                await self._run_cycle(started + Config.CYCLE_DEADLINE_SECONDS)
+            finally:
+                self.last_cycle_duration = time.monotonic() - started
+                self.max_cycle_duration = max(self.max_cycle_duration, self.last_cycle_duration)
+        
+        await self.bot.deliver_profile_report()
+        return True
     
-    async def _monitor_loop(self):
-        while not self._stop_event.is_set():
-            try:
-                await self._check_all_users()
-                await asyncio.sleep(Config.CHECK_INTERVAL_MINUTES * 60)
-            except asyncio.CancelledError:
-                break
-            except Exception as e:
-                await asyncio.sleep(60)
+    async def _run_cycle(self, deadline: float):
+        with self.profiler.cycle():
+            # One fetch per cycle; users whose group chunk is unchanged since they were
+            # last verified are skipped without touching their debounce state.
+            # Fetched in a worker thread so the loop keeps serving handlers meanwhile.
+            with self.profiler.paused():
+                schedules, group_hashes = await asyncio.to_thread(
+                    self.profiler.run, self.parser.get_all_schedules_with_hashes
+                )
+            users = self.data_manager.get_all_users() if schedules is not None else {}
+            order = self._cycle_order(users) if schedules is not None else []
+            confirmed = []
+            now = time.time()
+            local_hour = datetime.now(self._tz).hour
+            
+            # Confirmed changes go to the outbox first, then all user state is saved in one write;
+            # a restart in between re-detects the same change under the same idempotency key.
+            with self.data_manager.batch():
+                try:
+                    for position, chat_id_str in enumerate(order):
+                        # Chats go in slices: the first slice always runs, even if the fetch used up
+                        # the budget, and the loop yields between slices so handlers are served.
+                        if position and position % Config.CYCLE_SLICE_SIZE == 0:
+                            if time.monotonic() >= deadline:
+                                self._backlog = order[position:]
+                                self.overruns += 1
+                                logger.warning(
+                                    "Check cycle hit its %d s deadline, %d of %d chats left for the next cycle",
+                                    Config.CYCLE_DEADLINE_SECONDS, len(self._backlog), len(order),
+                                )
+                                break
+                            with self.profiler.paused():
+                                await asyncio.sleep(0)
+                        
+                        try:
+                            user_data = users.get(chat_id_str)
+                            chat_id = int(chat_id_str)
+                            user_group = user_data.get('group') if user_data else None
+                            
+                            if not user_group:
+                                continue
+                            
+                            group_key = self.parser.qualify_group(user_group)
+                            digest = group_hashes.get(group_key)
+                            if digest is not None and self._verified.get(chat_id) == (group_key, digest):
+                                continue
+                            
+                            current_schedule = schedules.get(group_key)
+                            change = self._confirm_change(chat_id, current_schedule)
+                            
+                            if current_schedule is not None and digest is not None and not self.data_manager.get_pending_count(chat_id):
+                                self._verified[chat_id] = (group_key, digest)
+                            
+                            if change:
+                                self._route_change(chat_id, user_group, change, now, local_hour, confirmed)
+                                
+                        except Exception as e:
+                            pass
+                    
+                    self._collect_due_digests(now, local_hour, confirmed)
+                finally:
+                    self.outbox.enqueue_many(confirmed)
+            
+            # Past the deadline, delivery is left to the periodic outbox drain.
+            if time.monotonic() < deadline:
+                with self.profiler.paused():
+                    await self.deliver_outbox(deadline - time.monotonic())
+    
+    def _cycle_order(self, users) -> List[str]:
+        # Chats left over by an overrun first, then everyone else in the usual order.
+        backlog = [chat_id for chat_id in self._backlog if chat_id in users]
+        self._backlog = []
+        if not backlog:
+            return list(users)
+        pending = set(backlog)
+        return backlog + [chat_id for chat_id in users if chat_id not in pending]
+    
+    def format_cycle_stats(self) -> str:
+        running = ""
+        if self._cycle_lock.locked():
+            running = f" (зараз триває {time.monotonic() - self._cycle_started:.0f} с)"
+        return (
+            f"🔁 Перевірок: {self.cycles_total}{running}, пропущено через попередню: {self.cycles_skipped}\n"
+            f"⏰ Перевищень дедлайну {Config.CYCLE_DEADLINE_SECONDS} с: {self.overruns}, "
+            f"чатів у черзі на наступну перевірку: {len(self._backlog)}\n"
+            f"⏱ Тривалість: остання {self.last_cycle_duration:.1f} с, max {self.max_cycle_duration:.1f} с\n"
+            f"📉 Відставання від розкладу: останнє {self.last_start_lag:.1f} с, max {self.max_start_lag:.1f} с"
+        )
     
-    async def _check_all_users(self):
-        users = self.data_manager.get_all_users()
+    def _route_change(self, chat_id: int, group: str, change: Tuple[List[List[str]], List[List[str]]],
+                      now: float, local_hour: int, confirmed: list):
+        current, previous = change
+        prefs = self.data_manager.get_delivery_prefs(chat_id)
+        seen, _ = self.data_manager.get_deferred(chat_id)
         
-        for chat_id_str, user_data in users.items():
+        # A change on top of an already deferred one, a digest subscriber, or quiet hours:
+        # remember what the user last saw and send the net diff later.
+        if seen is not None or prefs.mode == 'digest' or self._in_quiet_hours(prefs, local_hour):
+            due = now + prefs.digest_minutes * 60 if prefs.mode == 'digest' else now
+            self.data_manager.defer_change(chat_id, previous, due)
+            return
+        
+        message = self._change_notification(group, self._format_changes_message(current, previous))
+        confirmed.append((Outbox.make_key(chat_id, message), chat_id, message))
+    
+    def _collect_due_digests(self, now: float, local_hour: int, confirmed: list):
+        for chat_id in self.data_manager.deferred_chats():
             try:
-                chat_id = int(chat_id_str)
-                user_group = user_data.get('group')
-                
-                if not user_group:
+                seen, due = self.data_manager.get_deferred(chat_id)
+                prefs = self.data_manager.get_delivery_prefs(chat_id)
+                if (due or 0) > now or self._in_quiet_hours(prefs, local_hour):
                     continue
                 
-                changes = await self.check_user_schedule(chat_id, user_group)
+                group = self.data_manager.get_user_group(chat_id)
+                current = self.parser.normalize_schedule(self.data_manager.get_user_schedule(chat_id))
+                previous = self.parser.normalize_schedule(seen)
+                self.data_manager.clear_deferred(chat_id)
                 
-                if changes:
-                    message = f"⚠️ *Зміни в графіку групи {user_group}:*\n\n{changes}"
-                    await self.bot.send_notification(chat_id, message)
-                    
+                # Revisions that cancelled each other out leave nothing to report.
+                if group and not self._schedules_equal(current, previous):
+                    message = self._change_notification(group, self._format_changes_message(current, previous))
+                    confirmed.append((Outbox.make_key(chat_id, message), chat_id, message))
             except Exception as e:
                 pass
     
+    def set_delivery_prefs(self, chat_id: int, prefs: DeliveryPrefs) -> bool:
+        if not self.data_manager.set_delivery_prefs(chat_id, prefs):
+            return False
+        # Switching to immediate delivery releases a waiting digest on the next cycle.
+        seen, due = self.data_manager.get_deferred(chat_id)
+        if seen is not None and prefs.mode != 'digest' and (due or 0) > time.time():
+            with self.data_manager.batch():
+                self.data_manager.clear_deferred(chat_id)
+                self.data_manager.defer_change(chat_id, seen, time.time())
+        return True
+    
+    def _in_quiet_hours(self, prefs: DeliveryPrefs, local_hour: int) -> bool:
+        start, end = prefs.quiet_start, prefs.quiet_end
+        if start is None or end is None or start == end:
+            return False
+        if start < end:
+            return start <= local_hour < end
+        return local_hour >= start or local_hour < end
+    
+    def _change_notification(self, group: str, changes: str) -> str:
+        return f"⚠️ *Зміни в графіку групи {self.parser.group_label(group)}:*\n\n{changes}"
+    
+    async def deliver_outbox(self, budget: Optional[float] = None) -> int:
+        return await self.outbox.drain(self.bot.send_notification, budget)
+    
+    def invalidate(self, chat_id: int):
+        self._verified.pop(chat_id, None)
+        self._chat_results.pop(chat_id, None)
+    
+    async def get_group_schedule(self, group: str) -> Optional[List[List[str]]]:
+        # Callers share the returned lists and must not modify them.
+        group = self.parser.qualify_group(group)
+        provider_id = group.partition(':')[0]
+        
+        snapshot = self._provider_snapshots.get(provider_id)
+        if snapshot and time.monotonic() - snapshot[0] < Config.INTERACTIVE_COOLDOWN_SECONDS:
+            return snapshot[1].get(group)
+        
+        pending = self._provider_fetches.get(provider_id)
+        if pending is None:
+            pending = self._provider_fetches[provider_id] = asyncio.ensure_future(self._fetch_provider(provider_id))
+        # Shielded: a cancelled caller must not cancel the fetch other callers are waiting on.
+        schedules = await asyncio.shield(pending)
+        return None if schedules is None else schedules.get(group)
+    
+    async def _fetch_provider(self, provider_id: str) -> Optional[Dict[str, List[List[str]]]]:
+        # One page covers every group of the provider, so the snapshot serves them all.
+        try:
+            schedules = await asyncio.to_thread(self.parser.get_provider_schedules, provider_id)
+        except Exception as e:
+            schedules = None
+        if schedules is not None:
+            self._provider_snapshots[provider_id] = (time.monotonic(), schedules)
+        self._provider_fetches.pop(provider_id, None)
+        return schedules
+    
     async def check_user_schedule(self, chat_id: int, group: str) -> Optional[str]:
+        pending = self._chat_checks.get(chat_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        
+        recent = self._chat_results.get(chat_id)
+        if recent and recent[1] == group and time.monotonic() - recent[0] < Config.INTERACTIVE_COOLDOWN_SECONDS:
+            return recent[2]
+        
+        pending = self._chat_checks[chat_id] = asyncio.ensure_future(self._check_chat(chat_id, group))
+        return await asyncio.shield(pending)
+    
+    async def _check_chat(self, chat_id: int, group: str) -> Optional[str]:
+        try:
+            current_schedule = await self.get_group_schedule(group)
+            # Interactive checks may move the debounce state, so the next cycle re-verifies this chat.
+            self.invalidate(chat_id)
+            result = self._apply_schedule(chat_id, current_schedule)
+            
+            now = time.monotonic()
+            if len(self._chat_results) >= 1024:
+                self._chat_results = {
+                    chat: entry for chat, entry in self._chat_results.items()
+                    if now - entry[0] < Config.INTERACTIVE_COOLDOWN_SECONDS
+                }
+            self._chat_results[chat_id] = (now, group, result)
+            return result
+        finally:
+            self._chat_checks.pop(chat_id, None)
+    
+    def _apply_schedule(self, chat_id: int, current_schedule: Optional[List[List[str]]]) -> Optional[str]:
+        change = self._confirm_change(chat_id, current_schedule)
+        seen, _ = self.data_manager.get_deferred(chat_id)
+        if change:
+            current, previous = change
+        elif seen is not None:
+            # Nothing new upstream, but a deferred change has not been shown to the user yet.
+            current = self.parser.normalize_schedule(self.data_manager.get_user_schedule(chat_id))
+        else:
+            return None
+        
+        # The user sees this change now; anything deferred is folded into it.
+        if seen is not None:
+            previous = self.parser.normalize_schedule(seen)
+            self.data_manager.clear_deferred(chat_id)
+            if self._schedules_equal(current, previous):
+                return None
+        return self._format_changes_message(current, previous)
+    
+    def _confirm_change(self, chat_id: int, current_schedule: Optional[List[List[str]]]) -> Optional[Tuple[List[List[str]], List[List[str]]]]:
+        # Returns (current, previous) once a change is confirmed, None otherwise.
         try:
-            current_schedule = self.parser.get_group_schedule(group)
-
             # If we couldn't fetch/parse current schedule (transient error), do NOT treat it as a change
             # and do NOT overwrite the saved schedule.
             if current_schedule is None:
@@ -95,7 +341,7 @@ class ScheduleMonitor:
             # Confirmed change -> persist and notify
             self.data_manager.update_user_schedule(chat_id, current_schedule_normalized)
             self.data_manager.clear_pending_change(chat_id)
-            return self._format_changes_message(current_schedule_normalized, saved_schedule_normalized)
+            return current_schedule_normalized, saved_schedule_normalized
             
         except Exception as e:
             return None